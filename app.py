@@ -1,62 +1,200 @@
+import fcntl
+import io
 import os
-import cv2
-import numpy as np
-import time  # Essential for file-lock rectification
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
+import json
+import queue
+import re
+import hashlib
+import hmac
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Flask, Request, Response, abort, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from flask_mail import Mail, Message
+from sqlalchemy import tuple_
 from itsdangerous import URLSafeTimedSerializer as Serializer
-from PIL import Image, ImageEnhance
+
+import batch
+import database
+import imaging
+import metrics
+import storage
+from config import config_by_name
+from jobs import JobQueue, QueueFull
+from mail_queue import MailQueue
+from passwords import HasherBusy, LoginThrottle, PasswordHasher, throttled
+from result_cache import ResultCache
+from ttl_cache import TTLCache
+
+class InMemoryUploadRequest(Request):
+    # Uploads are already capped by MAX_CONTENT_LENGTH, so keep them in memory
+    # rather than letting Werkzeug spool anything over 500 KB to a temp file
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 
 # --- CONFIGURATION ---
-app.config['SECRET_KEY'] = 'nirvana_heritage_secure_2026'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Increase max content length to allow larger uploads (64MB)
-app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024 
+# Secret key, database, upload limit, folders and mail come from config.py;
+# APP_CONFIG selects default, development or production
+app.config.from_object(config_by_name[os.environ.get('APP_CONFIG', 'default')])
+database.configure(app)
+if app.config.get('REMOTE_ADDR_HEADER') == 'X-Forwarded-For':
+    # Otherwise every client shares the balancer's address in remote_addr
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=1)
 
 # Folder Configurations
-UPLOAD_FOLDER = os.path.join('static', 'uploads')
-PROCESSED_FOLDER = os.path.join('static', 'processed')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
+UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
+PROCESSED_FOLDER = app.config['PROCESSED_FOLDER']
+
+# Background jobs for /create (pool size, max unfinished jobs, seconds)
+app.config['JOB_WORKERS'] = max(1, (os.cpu_count() or 2) // 2)
+# Tile threads per job, so concurrent tiled denoises together use each core once
+app.config['DENOISE_WORKERS'] = max(1, (os.cpu_count() or 2) // app.config['JOB_WORKERS'])
+app.config['JOB_QUEUE_LIMIT'] = 16
+app.config['JOB_RETRY_AFTER'] = 5
+# Job status files, shared by every worker on this node
+app.config['JOB_STATE_FOLDER'] = os.environ.get('JOB_STATE_FOLDER', os.path.join(app.instance_path, 'jobs'))
+app.config['BATCH_MAX_FILES'] = 500
+
+# Output encoding defaults; requests may override format/quality/png_compression.
+# OUTPUT_FORMAT 'source' keeps the input's extension.
+app.config['OUTPUT_FORMAT'] = os.environ.get('OUTPUT_FORMAT', 'source')
+app.config['OUTPUT_QUALITY'] = int(os.environ.get('OUTPUT_QUALITY', 90))
+app.config['PNG_COMPRESSION'] = int(os.environ.get('PNG_COMPRESSION', 3))
+# Encode and write processed outputs on a background thread
+app.config['ASYNC_ENCODE'] = os.environ.get('ASYNC_ENCODE', '1') == '1'
+
+# Add a Server-Timing header with per-stage durations to every response
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+# /metrics is for admins and for scrapers sending "Authorization: Bearer <METRICS_TOKEN>"
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Processed-result cache (entries, seconds)
+app.config['RESULT_CACHE_SIZE'] = 512
+app.config['RESULT_CACHE_TTL'] = 3600
+
+# Artifact garbage collection (seconds between runs, 0 disables; byte quota)
+# Each node's workers share a lock file, so one of them collects per interval.
+# With several nodes on one S3 bucket, set the interval to 0 and run `flask gc` from cron on one host.
+app.config['ARTIFACT_GC_INTERVAL'] = int(os.environ.get('ARTIFACT_GC_INTERVAL', 600))
+app.config['GC_LOCK_FILE'] = os.environ.get('GC_LOCK_FILE', os.path.join(app.instance_path, 'artifact-gc.lock'))
+app.config['GC_BATCH_SIZE'] = 500
+app.config['PROCESSED_QUOTA_BYTES'] = int(os.environ.get('PROCESSED_QUOTA_BYTES', 10 * 1024 ** 3))
+# Also delete files in PROCESSED_FOLDER that have no lineage row (pre-store outputs)
+app.config['GC_DELETE_UNTRACKED'] = os.environ.get('GC_DELETE_UNTRACKED', '0') == '1'
+app.config['GC_UNTRACKED_AGE'] = 7 * 24 * 3600
+# With the S3 store, cap on this node's local copies, trimmed least recently used first on each GC run
+app.config['LOCAL_CACHE_BYTES'] = int(os.environ.get('LOCAL_CACHE_BYTES', 2 * 1024 ** 3))
+
+# Let the front-end server (nginx/Apache) send processed files via X-Sendfile
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+# Users listed per admin page; pages are keyed on email, which is indexed
+app.config['ADMIN_PAGE_SIZE'] = 50
+
+# --- PASSWORD HASHING ---
+# Work factor for new hashes; existing hashes are upgraded at the next login
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# At most HASH_WORKERS hashes run at once, with HASH_QUEUE_LIMIT more waiting
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', 2))
+app.config['HASH_QUEUE_LIMIT'] = 32
+# Auth form posts allowed per client IP per window, checked before hashing
+app.config['AUTH_RATE_LIMIT'] = int(os.environ.get('AUTH_RATE_LIMIT', 10))
+app.config['AUTH_RATE_WINDOW'] = 60
 
 # --- MAIL CONFIGURATION ---
-app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'e23ai023@sdnbvc.edu.in'
-app.config['MAIL_PASSWORD'] = 'jbny qhgn kljc ajmf'
+# Mail is delivered by a background sender; its SMTP connection is closed
+# after this many idle seconds
+app.config['MAIL_IDLE_TIMEOUT'] = 30
 
-# Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+# Uploads and results; creates the folders, which are this node's cache when the store is S3
+store = storage.from_config(app.config)
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+passwords = PasswordHasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS'],
+                           app.config['HASH_WORKERS'], app.config['HASH_QUEUE_LIMIT'])
+auth_throttle = LoginThrottle(app.config['AUTH_RATE_LIMIT'], app.config['AUTH_RATE_WINDOW'])
 mail = Mail(app)
+mail_queue = MailQueue(app, mail, app.config['MAIL_IDLE_TIMEOUT'])
 login_manager = LoginManager(app)
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_LIMIT'],
+                     state_dir=app.config['JOB_STATE_FOLDER'])
+result_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+# JSON results of analysis mode, keyed by source digest and analysis
+analysis_cache = TTLCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
 
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
+# --- INSTRUMENTATION ---
+metrics.registry.gauge('jobs_pending', 'Unfinished /create jobs', job_queue.pending)
+metrics.registry.counter('result_cache_hits_total', 'Result cache hits', lambda: result_cache.stats()['hits'])
+metrics.registry.counter('result_cache_misses_total', 'Result cache misses', lambda: result_cache.stats()['misses'])
+metrics.registry.gauge('result_cache_entries', 'Result cache entries', lambda: result_cache.stats()['entries'])
+metrics.registry.gauge('image_cache_bytes', 'Bytes of decoded images cached in this process',
+                       lambda: imaging.image_cache.nbytes)
+metrics.registry.gauge('mail_pending', 'Queued outgoing emails', mail_queue.pending)
+
+@app.before_request
+def start_metrics():
+    metrics.begin()
+
+@app.before_request
+def wait_for_processed_output():
+    # Outputs may still be encoding on a background thread or another worker
+    filename = (request.view_args or {}).get('filename', '')
+    if request.endpoint == 'static' and filename.startswith('processed/'):
+        imaging.wait_for_write(os.path.join(app.config['PROCESSED_FOLDER'], filename[len('processed/'):]))
+
+@app.after_request
+def record_metrics(response):
+    collector = metrics.end()
+    if collector is not None and request.endpoint != 'metrics_endpoint':
+        metrics.registry.record(collector, request.endpoint, response.status_code)
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = metrics.server_timing(collector)
+    return response
+
+def operation_label(operation, registry=imaging.OPERATIONS):
+    # Keep label cardinality bounded whatever the client sends (even a list or object)
+    return operation if isinstance(operation, str) and operation in registry else 'unknown'
+
 # --- DATABASE MODELS ---
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
+    # unique=True already gives the email lookups in login, reset_request and the admin pages an index
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(60), nullable=False)
     is_admin = db.Column(db.Boolean, default=False) 
 
+class Artifact(db.Model):
+    """Lineage of a processed output stored in PROCESSED_FOLDER under its content address."""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(80), unique=True, nullable=False)
+    source = db.Column(db.String(255), nullable=False)
+    parent = db.Column(db.String(80))
+    operations = db.Column(db.Text, nullable=False, default='[]')
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    accessed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # One primary-key SELECT per request. There is no cross-request cache:
+    # ORM objects are bound to their session, and the lookup is cheap
+    return db.session.get(User, int(user_id))
 
 # --- HELPER FUNCTIONS ---
 def send_reset_email(user):
@@ -69,7 +207,206 @@ def send_reset_email(user):
 
 If you did not make this request, simply ignore this email.
 '''
-    mail.send(msg)
+    mail_queue.send(msg)
+
+# --- ARTIFACT STORE ---
+# Processed outputs are named by the hash of what produced them: the source
+# bytes, the operation chain and the encoding settings. Identical results
+# therefore share one file, names no longer grow with every step, and a
+# result that already exists on disk is reused across workers and restarts.
+def artifact_name(cache_key, filename, fmt):
+    ext = os.path.splitext(imaging.output_name(filename, fmt))[1].lower()
+    return hashlib.sha256(cache_key.encode()).hexdigest()[:32] + ext
+
+def artifact_live(filename):
+    """False once GC (on any node) has deleted the artifact, whatever copies this node still holds."""
+    if db.session.query(Artifact.id).filter_by(filename=filename).first() is not None:
+        return True
+    return store.stored('processed', filename)
+
+def drop_stale_copy(filename):
+    """With a remote store, evict this node's copy of a collected artifact; True if it was stale."""
+    path = store.path('processed', filename)
+    if not store.remote or not os.path.isfile(path) or imaging.is_pending(path) or artifact_live(filename):
+        return False
+    store.evict('processed', filename)
+    return True
+
+def find_artifact(cache_key, output_filename):
+    """True if the artifact is cached, on disk, or being written right now."""
+    folder = app.config['PROCESSED_FOLDER']
+    if drop_stale_copy(output_filename):
+        return False
+    if result_cache.get(cache_key, folder):
+        return True
+    return imaging.is_pending(store.path('processed', output_filename)) or store.exists('processed', output_filename)
+
+def artifact_response(output_filename, **extra):
+    return jsonify({
+        'image_url': url_for('processed_file', filename=output_filename),
+        'filename': output_filename,
+        **extra
+    })
+
+def register_artifact(output_filename, input_filename, operations):
+    """Record (or refresh) the lineage row for an artifact."""
+    artifact = Artifact.query.filter_by(filename=output_filename).first()
+    if artifact:
+        artifact.accessed_at = datetime.utcnow()
+    else:
+        parent = Artifact.query.filter_by(filename=input_filename).first()
+        chain = json.loads(parent.operations) if parent else []
+        db.session.add(Artifact(
+            filename=output_filename,
+            source=parent.source if parent else input_filename,
+            parent=parent.filename if parent else None,
+            operations=json.dumps(chain + list(operations)),
+            owner_id=current_user.id if current_user.is_authenticated else None
+        ))
+    try:
+        db.session.commit()
+    except Exception as e:
+        # Another worker registered the same artifact first
+        db.session.rollback()
+        print("Artifact register error:", e)
+
+def touch_artifact(output_filename):
+    # accessed_at drives GC order; an hourly resolution is plenty
+    cutoff = datetime.utcnow() - timedelta(hours=1)
+    Artifact.query.filter(Artifact.filename == output_filename, Artifact.accessed_at < cutoff) \
+        .update({'accessed_at': datetime.utcnow()})
+    db.session.commit()
+
+def delete_artifact(artifact):
+    store.delete('processed', artifact.filename)
+    db.session.delete(artifact)
+
+def artifact_batches(*order):
+    """Yield Artifact rows in `order`, GC_BATCH_SIZE at a time, committing after each batch."""
+    key = None
+    while True:
+        query = Artifact.query.order_by(*order)
+        if key is not None:
+            query = query.filter(tuple_(*order) > key)
+        batch = query.limit(app.config['GC_BATCH_SIZE']).all()
+        if not batch:
+            return
+        key = tuple(getattr(batch[-1], column.key) for column in order)
+        yield batch
+        db.session.commit()
+
+def collect_garbage():
+    """Enforce the global quota on stored outputs, least recently used first.
+
+    Outputs are shared by everyone who produced the same result, so there is
+    no per-user quota: charging a file to whoever created it first would
+    evict other users' results for their usage.
+    """
+    stats = {'deleted': 0, 'freed_bytes': 0, 'missing': 0, 'untracked': 0}
+    grace = datetime.utcnow() - timedelta(minutes=10)
+    # One listing (a paginated LIST on S3) instead of a stat per artifact
+    stored = {name: (size, mtime) for name, size, mtime in store.list('processed')}
+
+    tracked = set()
+    total = 0
+    for batch in artifact_batches(Artifact.id):
+        for artifact in batch:
+            tracked.add(artifact.filename)
+            if artifact.filename not in stored:
+                # Jobs that failed or files removed by hand; allow time for pending writes and uploads
+                if artifact.created_at < grace and not imaging.is_pending(store.path('processed', artifact.filename)):
+                    db.session.delete(artifact)
+                    stats['missing'] += 1
+                continue
+            artifact.size = stored[artifact.filename][0]
+            total += artifact.size
+
+    if total > app.config['PROCESSED_QUOTA_BYTES']:
+        for batch in artifact_batches(Artifact.accessed_at, Artifact.id):
+            for artifact in batch:
+                if total <= app.config['PROCESSED_QUOTA_BYTES']:
+                    break
+                if artifact.filename not in stored:
+                    continue
+                size = stored[artifact.filename][0]
+                delete_artifact(artifact)
+                total -= size
+                stats['deleted'] += 1
+                stats['freed_bytes'] += size
+            if total <= app.config['PROCESSED_QUOTA_BYTES']:
+                break
+        db.session.commit()
+
+    if app.config['GC_DELETE_UNTRACKED']:
+        cutoff = datetime.utcnow().timestamp() - app.config['GC_UNTRACKED_AGE']
+        for name, (size, mtime) in stored.items():
+            if name not in tracked and mtime < cutoff:
+                stats['freed_bytes'] += size
+                store.delete('processed', name)
+                stats['untracked'] += 1
+
+    stats['remaining_bytes'] = total
+    return stats
+
+def run_gc(min_interval=0):
+    """Collect garbage under the node-wide GC lock.
+
+    Returns the stats, or None when another worker holds the lock or ran a
+    collection less than `min_interval` seconds ago.
+    """
+    os.makedirs(os.path.dirname(app.config['GC_LOCK_FILE']), exist_ok=True)
+    with open(app.config['GC_LOCK_FILE'], 'a+') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            # The lock file holds the time of the last run
+            f.seek(0)
+            last_run = float(f.read() or 0)
+            if time.time() - last_run < min_interval:
+                return None
+            stats = collect_garbage()
+            if store.remote:
+                stats['cache_trimmed_bytes'] = store.trim_cache(app.config['LOCAL_CACHE_BYTES'])
+            f.truncate(0)
+            f.write(str(time.time()))
+            return stats
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+@app.cli.command('gc')
+def gc_command():
+    """Run artifact garbage collection once."""
+    stats = run_gc()
+    print("Artifact GC:", stats if stats is not None else "already running")
+
+_gc_thread = None
+_gc_lock = threading.Lock()
+
+def gc_loop(interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                # Every worker wakes up, but only the first per interval collects
+                stats = run_gc(interval * 0.9)
+                if stats is not None:
+                    print("Artifact GC:", stats)
+            except Exception as e:
+                db.session.rollback()
+                print("Artifact GC error:", e)
+
+@app.before_request
+def start_artifact_gc():
+    # Started on the first request so scripts importing app (make_admin.py) don't spawn it
+    global _gc_thread
+    interval = app.config['ARTIFACT_GC_INTERVAL']
+    if _gc_thread is None and interval > 0:
+        with _gc_lock:
+            if _gc_thread is None:
+                _gc_thread = threading.Thread(target=gc_loop, args=(interval,), daemon=True, name='artifact-gc')
+                _gc_thread.start()
 
 # --- PUBLIC ROUTES ---
 @app.route('/')
@@ -103,7 +440,7 @@ def contact():
                           sender=app.config['MAIL_USERNAME'],
                           recipients=[app.config['MAIL_USERNAME']])
             msg.body = f"You have received a new inquiry.\n\nName: {name}\nEmail: {email}\n\nMessage:\n{message}"
-            mail.send(msg)
+            mail_queue.send(msg)
             flash('Your message has been sent to the artisans. We will respond shortly.', 'success')
         except Exception as e:
             flash('Message could not be sent. Please try again later.', 'danger')
@@ -116,6 +453,7 @@ def pricing():
 
 # --- AUTH ROUTES ---
 @app.route('/signup', methods=['GET', 'POST'])
+@throttled(auth_throttle, 'signup.html')
 def signup():
     if current_user.is_authenticated:
         return redirect(url_for('home'))
@@ -123,7 +461,7 @@ def signup():
         username = request.form.get('username')
         email = request.form.get('email')
         password = request.form.get('password')
-        hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_pw = passwords.hash(password)
         user = User(username=username, email=email, password=hashed_pw)
         try:
             db.session.add(user)
@@ -136,6 +474,7 @@ def signup():
     return render_template('signup.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@throttled(auth_throttle, 'login.html')
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('home'))
@@ -143,8 +482,14 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and passwords.check(user.password, password):
             login_user(user)
+            if passwords.needs_rehash(user.password):
+                try:
+                    user.password = passwords.hash(password)
+                    db.session.commit()
+                except HasherBusy:
+                    pass  # keep the old hash; it is upgraded on a later login
             return redirect(url_for('home'))
         else:
             flash('Login Unsuccessful. Please check credentials.', 'danger')
@@ -156,14 +501,41 @@ def logout():
     return redirect(url_for('splash'))
 
 # --- ADMIN ROUTES ---
+def user_page(search, after):
+    """One page of users ordered by email, optionally by email prefix.
+
+    Keyset pagination on the unique email index: the cursor is the last
+    email shown, so every page is an index range scan however deep it is.
+    """
+    query = User.query.order_by(User.email)
+    if search:
+        # Range bounds rather than LIKE so SQLite can use the index
+        query = query.filter(User.email >= search, User.email < search + '\U0010ffff')
+    if after:
+        query = query.filter(User.email > after)
+    users = query.limit(app.config['ADMIN_PAGE_SIZE'] + 1).all()
+    next_cursor = None
+    if len(users) > app.config['ADMIN_PAGE_SIZE']:
+        users = users[:app.config['ADMIN_PAGE_SIZE']]
+        next_cursor = users[-1].email
+    return users, next_cursor
+
+def admin_listing(template):
+    search = request.args.get('q', '').strip()
+    users, next_cursor = user_page(search, request.args.get('after'))
+    stats = {
+        'total': db.session.query(db.func.count(User.id)).scalar(),
+        'admins': db.session.query(db.func.count(User.id)).filter(User.is_admin.is_(True)).scalar()
+    }
+    return render_template(template, users=users, stats=stats, search=search, next_cursor=next_cursor)
+
 @app.route('/admin')
 @login_required
 def admin():
     if not current_user.is_admin:
         flash('Admin access required.', 'danger')
         return redirect(url_for('home'))
-    users = User.query.all()
-    return render_template('admin.html', users=users)
+    return admin_listing('admin.html')
 
 @app.route('/admin_dashboard')
 @login_required
@@ -171,8 +543,7 @@ def admin_dashboard():
     if not current_user.is_admin:
         flash('Admin access required.', 'danger')
         return redirect(url_for('home'))
-    users = User.query.all()
-    return render_template('admin_dashboard.html', users=users)
+    return admin_listing('admin_dashboard.html')
 
 @app.route('/make_admin/<int:user_id>', methods=['POST'])
 @login_required
@@ -181,7 +552,7 @@ def make_admin(user_id):
         flash('Admin access required.', 'danger')
         return redirect(url_for('home'))
     
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if user:
         user.is_admin = True
         db.session.commit()
@@ -201,7 +572,7 @@ def remove_admin(user_id):
         flash('You cannot revoke your own admin privileges.', 'danger')
         return redirect(url_for('admin_dashboard'))
     
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if user:
         user.is_admin = False
         db.session.commit()
@@ -221,8 +592,9 @@ def delete_user(user_id):
         flash('You cannot delete your own account.', 'danger')
         return redirect(url_for('admin_dashboard'))
     
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if user:
+        Artifact.query.filter_by(owner_id=user.id).update({'owner_id': None})
         db.session.delete(user)
         db.session.commit()
         flash(f'{user.username} has been deleted.', 'success')
@@ -230,6 +602,16 @@ def delete_user(user_id):
         flash('User not found.', 'danger')
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/gc', methods=['POST'])
+@login_required
+def admin_gc():
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin access required.'}), 403
+    stats = run_gc()
+    if stats is None:
+        return jsonify({'error': 'Garbage collection is already running.'}), 409
+    return jsonify(stats)
+
 # --- PASSWORD RESET FLOW ---
 @app.route('/reset_password', methods=['GET', 'POST'])
 def reset_request():
@@ -239,7 +621,12 @@ def reset_request():
         email = request.form.get('email')
         user = User.query.filter_by(email=email).first()
         if user:
-            send_reset_email(user)
+            try:
+                send_reset_email(user)
+            except queue.Full:
+                # The mail backlog is at its limit; don't claim an email is on its way
+                flash('Reset emails are delayed right now. Please try again in a few minutes.', 'warning')
+                return render_template('reset_request.html'), 503
             flash('An email has been sent with instructions to reset your password.', 'info')
             return redirect(url_for('login'))
         else:
@@ -247,6 +634,7 @@ def reset_request():
     return render_template('reset_request.html')
 
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
+@throttled(auth_throttle, 'reset_token.html')
 def reset_token(token):
     if current_user.is_authenticated:
         return redirect(url_for('home'))
@@ -255,9 +643,9 @@ def reset_token(token):
     except:
         flash('That is an invalid or expired token', 'warning')
         return redirect(url_for('reset_request'))
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if request.method == 'POST':
-        hashed_pw = bcrypt.generate_password_hash(request.form.get('password')).decode('utf-8')
+        hashed_pw = passwords.hash(request.form.get('password'))
         user.password = hashed_pw
         db.session.commit()
         flash('Your password has been updated!', 'success')
@@ -270,152 +658,573 @@ def reset_token(token):
 def create():
     if request.method == 'POST':
         file = request.files.get('file')
-        if file and file.filename != '':
+        uploaded = secure_filename(request.form.get('upload', ''))
+        if file and file.filename:
             filename = secure_filename(file.filename)
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(input_path)
-
-            output_name = 'heritage_' + filename
-            output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_name)
-            
-            # RECTIFICATION: Breath before read
-            time.sleep(0.2)
-            img = cv2.imread(input_path)
-            if img is not None:
-                denoised = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
-                pil_img = Image.fromarray(cv2.cvtColor(denoised, cv2.COLOR_BGR2RGB))
-                enhancer = ImageEnhance.Color(pil_img)
-                pil_img = enhancer.enhance(1.2)
-                pil_img.save(output_path)
-                return render_template('create.html', processed=output_name)
-            else:
-                flash('Artifact unreadable. Please try a different format.', 'danger')
-    
+        elif uploaded:
+            # Already sent straight to storage with a form from /uploads/presign
+            filename = uploaded
+        else:
+            return jsonify({'error': 'No artifact was uploaded.'}), 400
+
+        try:
+            encoding = encoding_options(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if file and file.filename:
+            data = file.read()
+        else:
+            upload_path = store.fetch('uploads', filename)
+            if upload_path is None:
+                return jsonify({'error': f'Artifact not found: {filename}'}), 404
+            with open(upload_path, 'rb') as f:
+                data = f.read()
+        try:
+            imaging.read_dimensions(io.BytesIO(data))
+        except imaging.ImageTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+
+        cache_key = result_cache.make_key(hashlib.sha256(data).hexdigest(), 'heritage', encoding)
+        output_name = artifact_name(cache_key, filename, encoding['format'])
+        output_path = store.path('processed', output_name)
+        if file and file.filename:
+            store.put_bytes('uploads', filename, data)
+        if store.exists('processed', output_name):
+            touch_artifact(output_name)
+            return jsonify({
+                'status': 'done',
+                'processed': output_name,
+                'image_url': url_for('processed_file', filename=output_name)
+            })
+
+        # Denoising takes seconds at full resolution, so it runs in the job pool
+        # on the uploaded bytes; the original is written to disk alongside
+        try:
+            job_id = job_queue.submit(imaging.enhance_heritage, data, output_path,
+                                      encoding['quality'], encoding['png_compression'],
+                                      app.config['DENOISE_WORKERS'],
+                                      owner=current_user.get_id(),
+                                      callback=lambda name: store.save('processed', name))
+        except QueueFull:
+            response = jsonify({'error': 'The artisans are busy. Please try again shortly.'})
+            response.headers['Retry-After'] = str(app.config['JOB_RETRY_AFTER'])
+            return response, 429
+
+        register_artifact(output_name, filename, ['heritage'])
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('job_status', job_id=job_id)
+        }), 202
+
     return render_template('create.html', processed=None)
 
+def get_own_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job['owner'] != current_user.get_id():
+        return None
+    return job
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+
+    body = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        body['processed'] = job['result']
+        body['image_url'] = url_for('processed_file', filename=job['result'])
+        body['result_url'] = url_for('job_result', job_id=job_id)
+    elif job['status'] == 'failed':
+        body['error'] = job['error']
+    return jsonify(body)
+
+@app.route('/jobs/<job_id>/result')
+@login_required
+def job_result(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'status': 'failed', 'error': job['error']}), 422
+    if job['status'] != 'done':
+        return jsonify({'status': job['status']}), 202
+    return send_processed(job['result'])
+
+@app.route('/uploads/presign', methods=['POST'])
+@login_required
+def presign_upload():
+    """Form fields for uploading an image straight to storage, bypassing this server.
+
+    Post the file to `url` with `fields`, then call /create with
+    upload=<filename>. Only available with an S3 store.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename', ''))
+    if not filename:
+        return jsonify({'error': 'Provide the filename to upload.'}), 400
+    form = store.upload_form(filename, app.config['MAX_CONTENT_LENGTH'])
+    if form is None:
+        return jsonify({'error': 'Direct uploads are not enabled; post the file to /create.'}), 404
+    return jsonify(form)
+
 # --- ARTISAN AI PROCESSING ROUTE (Optimized) ---
+# Every processing route checks its input with these before touching it, so
+# a malformed name or operation is a 400 rather than a 500 or an unchanged copy
+def json_body():
+    """The request's JSON object, or {} for anything else."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def invalid_operations(operations, registry=imaging.OPERATIONS):
+    """Error message for a bad list of operation names, or None if every one is in `registry`."""
+    if not isinstance(operations, list) or not operations:
+        return 'Provide a non-empty list of operations.'
+    if not all(isinstance(op, str) for op in operations):
+        return 'Operations must be names (strings).'
+    unknown = [op for op in operations if op not in registry]
+    if unknown:
+        return f"Unknown operations: {', '.join(unknown)}. Choose from: {', '.join(registry)}."
+    return None
+
+def invalid_request(filename, operations, registry=imaging.OPERATIONS):
+    """Error message for a bad filename or operation list, or None if both are usable."""
+    if not isinstance(filename, str) or not filename or os.path.basename(filename) != filename:
+        return 'Provide the filename of an uploaded or processed image.'
+    return invalid_operations(operations, registry)
+
+def resolve_input_path(filename):
+    """Local path of a processed or uploaded image, fetched from the store if needed; None if missing."""
+    if not filename or os.path.basename(filename) != filename:
+        return None
+    imaging.wait_for_write(store.path('processed', filename))
+    return store.fetch('processed', filename) or store.fetch('uploads', filename)
+
+def encoding_options(data):
+    """Output format, quality and PNG compression from a request, with deployment defaults."""
+    fmt = data.get('format') or app.config['OUTPUT_FORMAT']
+    if fmt == 'source':
+        fmt = None
+    elif fmt not in imaging.available_formats():
+        raise ValueError(f"Unsupported format '{fmt}'. Choose from: source, {', '.join(imaging.available_formats())}.")
+    try:
+        quality = int(data.get('quality', app.config['OUTPUT_QUALITY']))
+        png_compression = int(data.get('png_compression', app.config['PNG_COMPRESSION']))
+    except (TypeError, ValueError):
+        raise ValueError('quality and png_compression must be integers.')
+    if not 1 <= quality <= 100 or not 0 <= png_compression <= 9:
+        raise ValueError('quality must be 1-100 and png_compression 0-9.')
+    return {'format': fmt, 'quality': quality, 'png_compression': png_compression}
+
+def save_output(output_filename, img, encoding, cache_key):
+    """Write a processed image and record it in the result cache once it is on disk."""
+    folder = app.config['PROCESSED_FOLDER']
+    output_path = store.path('processed', output_filename)
+
+    def on_done():
+        result_cache.put(cache_key, output_filename, folder)
+        store.save('processed', output_filename)
+
+    if app.config['ASYNC_ENCODE']:
+        imaging.write_image_async(output_path, img, encoding['quality'], encoding['png_compression'], on_done)
+    else:
+        imaging.write_image(output_path, img, encoding['quality'], encoding['png_compression'])
+        on_done()
+
+# --- PREVIEWS (viewport-sized proxies, full resolution on download) ---
+# With "preview": <viewport side in px>, an artisan or advanced op runs on a
+# cached pyramid level of the original instead of the full image. Previews
+# chain like any artifact; download_file replays the recorded operations
+# on the original at full resolution.
+PREVIEW_PREFIX = 'preview-'
+# Only names this code generates; an upload may well be called preview-something.jpg
+PREVIEW_NAME = re.compile(r'^preview-[0-9a-f]{32}\.[A-Za-z0-9]+$')
+
+def is_preview(filename):
+    return bool(PREVIEW_NAME.match(filename))
+
+def preview_lineage(filename):
+    """(original, operations to replay) for a preview; None once its history is collected."""
+    operations = []
+    while is_preview(filename):
+        artifact = Artifact.query.filter_by(filename=filename).first()
+        if artifact is None:
+            return None
+        operations.insert(0, json.loads(artifact.operations)[-1])
+        filename = artifact.parent or artifact.source
+    return filename, [op for op in operations if op in imaging.OPERATIONS]
+
+def process_preview(data, filename, operation):
+    # The route has checked the operation: lineage must only
+    # record what the preview actually shows, or the download would differ
+    try:
+        side = int(data['preview'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'preview must be the viewport size in pixels.'}), 400
+    lineage = preview_lineage(filename)
+    input_path = resolve_input_path(lineage[0]) if lineage else None
+    if input_path is None:
+        return jsonify({'error': f'Artifact not found: {filename}'}), 404
+    operations = lineage[1] + [operation]
+
+    try:
+        encoding = encoding_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with metrics.stage('lookup'):
+        cache_key = result_cache.make_key(result_cache.source_digest(input_path), 'preview',
+                                          {'level': imaging.preview_level(side), 'operations': operations, **encoding})
+        output_filename = PREVIEW_PREFIX + artifact_name(cache_key, filename, encoding['format'])
+        found = find_artifact(cache_key, output_filename)
+    if found:
+        touch_artifact(output_filename)
+        return artifact_response(output_filename, preview=True)
+
+    try:
+        img = imaging.pyramid_image(input_path, side)
+    except imaging.ImageTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    if img is None:
+        return jsonify({'error': 'Royal Alchemy failed to read image source. Ensure file is not corrupt.'}), 400
+
+    processed = imaging.run_pipeline(img, operations)
+    save_output(output_filename, processed, encoding, cache_key)
+    register_artifact(output_filename, filename, [operation])
+
+    return artifact_response(output_filename, preview=True)
+
+def render_preview(filename):
+    """Name of the full-resolution render of a preview, rendering it on first request."""
+    lineage = preview_lineage(filename)
+    input_path = resolve_input_path(lineage[0]) if lineage else None
+    if input_path is None:
+        abort(404)
+    original, operations = lineage
+
+    # Same format as the preview unless the download asks for another
+    ext = os.path.splitext(filename)[1].lower()
+    fmt = next((name for name, suffix in imaging.OUTPUT_FORMATS.items() if suffix == ext), None)
+    try:
+        encoding = encoding_options({'format': fmt, **request.args.to_dict()})
+    except ValueError as e:
+        abort(400, str(e))
+
+    # Keyed like /process_pipeline, which would produce the same image
+    cache_key = result_cache.make_key(result_cache.source_digest(input_path), 'pipeline',
+                                      {'operations': operations, **encoding})
+    output_filename = artifact_name(cache_key, original, encoding['format'])
+    if find_artifact(cache_key, output_filename):
+        touch_artifact(output_filename)
+        return output_filename
+
+    try:
+        img = imaging.read_image(input_path, imaging.MAX_SIDE)
+    except imaging.ImageTooLarge as e:
+        abort(413, str(e))
+    if img is None:
+        abort(400)
+    save_output(output_filename, imaging.run_pipeline(img, operations), encoding, cache_key)
+    register_artifact(output_filename, original, operations)
+    return output_filename
+
 @app.route('/process_artisan', methods=['POST'])
 @login_required
 def process_artisan():
-    data = request.json
+    data = json_body()
     filename = data.get('filename')
     operation = data.get('operation')
+    metrics.annotate(operation=operation_label(operation, imaging.ARTISAN_OPERATIONS))
+    error = invalid_request(filename, [operation], imaging.ARTISAN_OPERATIONS)
+    if error:
+        return jsonify({'error': error}), 400
+    if data.get('preview'):
+        return process_preview(data, filename, operation)
     
-    input_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
-    if not os.path.exists(input_path):
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-    if not os.path.exists(input_path):
+    input_path = resolve_input_path(filename)
+    if input_path is None:
         return jsonify({'error': f'Artifact not found: {filename}'}), 404
 
-    # RECTIFICATION: OS Lock buffer and read validation
-    time.sleep(0.2)
-    img = cv2.imread(input_path)
+    try:
+        encoding = encoding_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with metrics.stage('lookup'):
+        cache_key = result_cache.make_key(result_cache.source_digest(input_path), f"artisan:{operation}", encoding)
+        output_filename = artifact_name(cache_key, filename, encoding['format'])
+        found = find_artifact(cache_key, output_filename)
+    if found:
+        touch_artifact(output_filename)
+        return artifact_response(output_filename)
+
+    try:
+        img = imaging.read_image(input_path, imaging.MAX_SIDE)
+    except imaging.ImageTooLarge as e:
+        return jsonify({'error': str(e)}), 413
     if img is None:
         return jsonify({'error': 'Artisan could not access the image stream.'}), 400
     
-    h, w = img.shape[:2]
-    if max(h, w) > 2500:
-        scale = 2500 / max(h, w)
-        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-
-    if operation == 'dilation':
-        kernel = np.ones((5,5), np.uint8)
-        processed = cv2.dilate(img, kernel, iterations=1)
-    elif operation == 'edges':
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        processed = cv2.Canny(gray, 100, 200)
-        processed = cv2.cvtColor(processed, cv2.COLOR_GRAY2BGR)
-    elif operation == 'remove_bg':
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, mask = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
-        processed = cv2.bitwise_and(img, img, mask=mask)
-    else:
-        processed = img
-
-    output_filename = f"artisan_{operation}_{filename}"
-    output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-    cv2.imwrite(output_path, processed)
+    processed = imaging.apply_operation(img, operation, imaging.ARTISAN_OPERATIONS)
+    save_output(output_filename, processed, encoding, cache_key)
+    register_artifact(output_filename, filename, [operation])
     
-    return jsonify({'image_url': url_for('static', filename='processed/' + output_filename)})
+    return artifact_response(output_filename)
 
 # --- ADVANCED ROYAL CV FEATURES (Optimized for Timeout) ---
 @app.route('/process_advanced', methods=['POST'])
 @login_required
 def process_advanced():
-    data = request.json
-    filename = data.get('filename')
+    # The studio posts its cropped canvas as a file so heavy ops (kmeans) run here, not in the browser
+    file = request.files.get('file')
+    data = request.form if file else json_body()
     operation = data.get('operation')
-    
-    input_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
-    if not os.path.exists(input_path):
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    
-    if not os.path.exists(input_path):
-        return jsonify({'error': f'Artifact not found: {filename}'}), 404
+    metrics.annotate(operation=operation_label(operation, imaging.ADVANCED_OPERATIONS))
+    filename = (secure_filename(file.filename) or 'canvas.png') if file else data.get('filename')
+    preview = data.get('preview') and not file
+    analysis = data.get('mode') == 'analysis' and not preview
+    error = invalid_request(filename, [operation], imaging.ANALYSES if analysis else imaging.ADVANCED_OPERATIONS)
+    if error:
+        return jsonify({'error': error}), 400
+    if preview:
+        return process_preview(data, filename, operation)
+
+    if file:
+        source = file.read()
+        try:
+            imaging.read_dimensions(io.BytesIO(source))
+        except imaging.ImageTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        digest = hashlib.sha256(source).hexdigest()
+    else:
+        input_path = resolve_input_path(filename)
+        if input_path is None:
+            return jsonify({'error': f'Artifact not found: {filename}'}), 404
+        digest = result_cache.source_digest(input_path)
+
+    def load_image():
+        if file:
+            img = imaging.decode_bytes(source)
+            return imaging.limit_size(img) if img is not None else None
+        return imaging.read_image(input_path, imaging.MAX_SIDE)
 
-    # RECTIFICATION: Wait for file release and validate read to prevent backend crash
-    time.sleep(0.2)
-    img = cv2.imread(input_path)
+    if analysis:
+        return analyze_image(operation, digest, load_image)
+
+    try:
+        encoding = encoding_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with metrics.stage('lookup'):
+        cache_key = result_cache.make_key(digest, f"royal:{operation}", encoding)
+        output_filename = artifact_name(cache_key, filename, encoding['format'])
+        found = find_artifact(cache_key, output_filename)
+    if found:
+        touch_artifact(output_filename)
+        return artifact_response(output_filename)
+
+    try:
+        img = load_image()
+    except imaging.ImageTooLarge as e:
+        return jsonify({'error': str(e)}), 413
     if img is None: 
         return jsonify({'error': 'Royal Alchemy failed to read image source. Ensure file is not corrupt.'}), 400
 
-    h, w = img.shape[:2]
-    if max(h, w) > 2500:
-        scale = 2500 / max(h, w)
-        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-
-    if operation == 'detect_objects':
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        blur = cv2.GaussianBlur(gray, (5,5), 0)
-        edged = cv2.Canny(blur, 30, 150)
-        contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        processed = img.copy()
-        cv2.drawContours(processed, contours, -1, (0, 215, 255), 2)
-
-    elif operation == 'sketch':
-        gray, _ = cv2.pencilSketch(img, s_sigma=60, r_sigma=0.07, shade_factor=0.05)
-        processed = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-
-    elif operation == 'detail':
-        processed = cv2.detailEnhance(img, sigma_s=10, sigma_r=0.15)
-
-    elif operation == 'sharpen':
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        processed = cv2.filter2D(img, -1, kernel)
-
-    elif operation == 'bw':
-        processed = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        processed = cv2.cvtColor(processed, cv2.COLOR_GRAY2BGR)
-
-    elif operation == 'vintage':
-        kernel = np.array([[0.272, 0.534, 0.131],
-                           [0.349, 0.686, 0.168],
-                           [0.393, 0.769, 0.189]])
-        processed = cv2.transform(img, kernel)
+    processed = imaging.apply_operation(img, operation, imaging.ADVANCED_OPERATIONS)
+    save_output(output_filename, processed, encoding, cache_key)
+    register_artifact(output_filename, filename, [operation])
     
-    elif operation == 'resize':
-        width = int(img.shape[1] * 0.75)
-        height = int(img.shape[0] * 0.75)
-        processed = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    return artifact_response(output_filename)
+
+def analyze_image(operation, digest, load_image):
+    """Vector results (boxes, areas, polygons) for the browser to draw its own overlay."""
+    cache_key = result_cache.make_key(digest, f"analysis:{operation}")
+    result = analysis_cache.get(cache_key)
+    if result is None:
+        try:
+            img = load_image()
+        except imaging.ImageTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        if img is None:
+            return jsonify({'error': 'Royal Alchemy failed to read image source. Ensure file is not corrupt.'}), 400
+        with metrics.stage('compute'):
+            result = imaging.ANALYSES[operation](img)
+        analysis_cache.set(cache_key, result)
+    return jsonify({'operation': operation, **result})
+
+# --- FUSED PIPELINE (one decode, one encode for a whole chain) ---
+@app.route('/process_pipeline', methods=['POST'])
+@login_required
+def process_pipeline():
+    data = json_body()
+    filename = data.get('filename')
+    operations = data.get('operations')
+    metrics.annotate(operation='pipeline')
+
+    error = invalid_request(filename, operations)
+    if error:
+        return jsonify({'error': error}), 400
+
+    input_path = resolve_input_path(filename)
+    if input_path is None:
+        return jsonify({'error': f'Artifact not found: {filename}'}), 404
+
+    try:
+        encoding = encoding_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    with metrics.stage('lookup'):
+        cache_key = result_cache.make_key(result_cache.source_digest(input_path), 'pipeline',
+                                          {'operations': operations, **encoding})
+        output_filename = artifact_name(cache_key, filename, encoding['format'])
+        found = find_artifact(cache_key, output_filename)
+    if found:
+        touch_artifact(output_filename)
     else:
-        processed = img
+        try:
+            img = imaging.read_image(input_path, imaging.MAX_SIDE)
+        except imaging.ImageTooLarge as e:
+            return jsonify({'error': str(e)}), 413
+        if img is None:
+            return jsonify({'error': 'Royal Alchemy failed to read image source. Ensure file is not corrupt.'}), 400
 
-    output_filename = f"royal_{operation}_{filename}"
-    output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-    cv2.imwrite(output_path, processed)
-    
-    return jsonify({'image_url': url_for('static', filename='processed/' + output_filename)})
+        processed = imaging.run_pipeline(img, operations)
+        save_output(output_filename, processed, encoding, cache_key)
+        register_artifact(output_filename, filename, operations)
+
+    return artifact_response(output_filename, operations=operations)
+
+# --- BATCH PROCESSING (many images, one operation chain, streamed ZIP) ---
+@app.route('/process_batch', methods=['POST'])
+@login_required
+def process_batch():
+    operations = request.form.get('operations', '')
+    try:
+        operations = json.loads(operations)
+    except ValueError:
+        operations = [op.strip() for op in operations.split(',') if op.strip()]
+    error = invalid_operations(operations)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        encoding = encoding_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'Upload images or a ZIP archive as "files".'}), 400
+    if job_queue.pending() >= job_queue.max_pending:
+        response = jsonify({'error': 'The artisans are busy. Please try again shortly.'})
+        response.headers['Retry-After'] = str(app.config['JOB_RETRY_AFTER'])
+        return response, 429
+
+    # Upload streams are closed with the request, before the response finishes
+    uploads = [(upload.filename, upload.read()) for upload in files]
+    inputs = batch.iter_inputs(uploads, app.config['BATCH_MAX_FILES'], app.config['MAX_CONTENT_LENGTH'])
+    try:
+        first = next(inputs, None)
+    except batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    if first is None:
+        return jsonify({'error': 'No images found in the upload.'}), 400
+
+    input_errors = []
+
+    def tasks():
+        try:
+            for name, data in itertools.chain([first], inputs):
+                name = imaging.output_name(name, encoding['format'])
+                yield name, (data, operations, os.path.splitext(name)[1] or '.png',
+                             encoding['quality'], encoding['png_compression'])
+        except batch.BatchError as e:
+            # Stop reading input but let images already in flight finish
+            input_errors.append(str(e))
+
+    def results():
+        yield from job_queue.stream(imaging.process_encoded, tasks())
+        for error in input_errors:
+            yield 'batch', None, error
+
+    return Response(stream_with_context(batch.stream_zip(results())),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=nirvana_batch.zip'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Scrapers send the configured token; admins can also look from the browser
+    token = app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    if not authorized and not (current_user.is_authenticated and current_user.is_admin):
+        return jsonify({'error': 'Admin access or the metrics token required.'}), 403
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats')
+@login_required
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+# --- SERVING PROCESSED FILES ---
+# Content-addressed artifact names never change meaning, so they can be cached forever
+ARTIFACT_NAME = re.compile(r'^(preview-)?[0-9a-f]{32}\.[A-Za-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def send_processed(filename, as_attachment=False):
+    """Serve a processed file with a strong content ETag, 304s and Range support.
+
+    send_file hands the open file to wsgi.file_wrapper (sendfile under
+    gunicorn) or to X-Sendfile when USE_X_SENDFILE is set.
+    """
+    folder = app.config['PROCESSED_FOLDER']
+    path = safe_join(folder, filename)
+    if path is None:
+        abort(404)
+    imaging.wait_for_write(path)
+    if drop_stale_copy(filename):
+        abort(404)
+    if not os.path.isfile(path):
+        if store.remote and store.exists('processed', filename):
+            # Not cached on this node; send the browser straight to the bucket
+            return redirect(store.download_url('processed', filename, as_attachment))
+        abort(404)
+
+    store.touch('processed', filename)
+    response = send_from_directory(folder, filename, as_attachment=as_attachment,
+                                   etag=result_cache.source_digest(path), conditional=True)
+    if ARTIFACT_NAME.match(filename):
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    else:
+        # Legacy names can be overwritten, so caches must revalidate
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    if as_attachment:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+@app.route('/processed/<filename>')
+def processed_file(filename):
+    return send_processed(filename)
 
 @app.route('/download/<filename>')
 @login_required
 def download_file(filename):
-    return send_from_directory(app.config['PROCESSED_FOLDER'], filename, as_attachment=True)
+    if is_preview(filename):
+        filename = render_preview(filename)
+    return send_processed(filename, as_attachment=True)
 
 # --- INITIALIZATION ---
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all() 
+        db.create_all()
         print("Nirvana Heritage Backend Active!")
     app.run(debug=True)
\ No newline at end of file
@@ -1,11 +1,13 @@
 import os
 import cv2
 import uuid
+import json
+import base64
 import boto3
 import time
 from datetime import datetime
 from flask import (
-    Flask, render_template, request,
+    Flask, render_template, request, session,
     redirect, url_for, flash, send_from_directory
 )
 from flask_login import (
@@ -13,36 +15,111 @@ from flask_login import (
     login_required, logout_user, current_user
 )
 from flask_bcrypt import Bcrypt
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
+import imaging
+import storage
+from outbox import Outbox
+from passwords import HasherBusy, LoginThrottle, PasswordHasher, throttled
+from ttl_cache import TTLCache
+
 # ---------------- APP CONFIG ----------------
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'nirvana_heritage_secure_2026'
+# Load balancer hops in front of the app; their X-Forwarded-For gives the
+# client address that the per-IP auth throttle keys on
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=1)
 
 # ---------------- AWS CONFIG ----------------
 AWS_REGION = 'us-east-1'
 SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:253490749648:aws_capstone_pp'
-dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+# Point at DynamoDB Local (e.g. http://localhost:8000) for development, or
+# use memory:// for the in-process stand-in in fake_dynamodb.py (tests)
+DYNAMODB_ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL')
+if DYNAMODB_ENDPOINT_URL == 'memory://':
+    from fake_dynamodb import FakeDynamoDB
+    dynamodb = FakeDynamoDB()
+else:
+    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT_URL)
 sns = boto3.client('sns', region_name=AWS_REGION)
 
 users_table = dynamodb.Table('NH_Users')
 logs_table = dynamodb.Table('NH_AdminLogs')
 
+# Global secondary indexes behind the admin dashboard. Every item carries a
+# constant 'kind' partition key so one index query returns users ordered by
+# email and logs ordered by time, without scanning either table:
+#   NH_Users      kind-email-index      (kind HASH, email RANGE)
+#   NH_AdminLogs  kind-timestamp-index  (kind HASH, timestamp RANGE)
+# Run `flask --app app_aws backfill-index-keys` once for items created
+# before the indexes existed.
+USERS_EMAIL_INDEX = 'kind-email-index'
+LOGS_TIME_INDEX = 'kind-timestamp-index'
+app.config['ADMIN_PAGE_SIZE'] = 50
+# The admin count is a counter item in NH_AdminLogs (outside the log index),
+# kept by make_admin; `flask --app app_aws recount-admins` rebuilds it
+ADMIN_COUNT_KEY = {'log_id': 'admin-count'}
+# Seconds between DescribeTable calls for the dashboard's user total
+app.config['TABLE_STATS_TTL'] = int(os.environ.get('TABLE_STATS_TTL', 300))
+table_stats = TTLCache(4, app.config['TABLE_STATS_TTL'])
+
+# Notifications and admin logs are sent from a background outbox; login
+# notifications are folded into at most one SNS message per window
+app.config['OUTBOX_FLUSH_INTERVAL'] = float(os.environ.get('OUTBOX_FLUSH_INTERVAL', 1.0))
+app.config['LOGIN_NOTIFY_WINDOW'] = int(os.environ.get('LOGIN_NOTIFY_WINDOW', 60))
+outbox = Outbox(
+    sns, SNS_TOPIC_ARN, logs_table,
+    flush_interval=app.config['OUTBOX_FLUSH_INTERVAL'],
+    coalesce_window=app.config['LOGIN_NOTIFY_WINDOW']
+)
+
 # ---------------- FILE CONFIG ----------------
-UPLOAD_FOLDER = 'static/uploads'
-PROCESSED_FOLDER = 'static/processed'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'static/uploads')
+PROCESSED_FOLDER = os.environ.get('PROCESSED_FOLDER', 'static/processed')
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 
+# STORAGE_BACKEND=s3 keeps images in S3_BUCKET so any node can serve them;
+# the folders above then act as this node's cache
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_REGION'] = AWS_REGION
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+store = storage.from_config(app.config)
+
 # ---------------- AUTH CONFIG ----------------
 bcrypt = Bcrypt(app)
+
+# Hashing runs in a capped pool; auth posts are rate limited per IP first
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', 2))
+app.config['HASH_QUEUE_LIMIT'] = 32
+app.config['AUTH_RATE_LIMIT'] = int(os.environ.get('AUTH_RATE_LIMIT', 10))
+app.config['AUTH_RATE_WINDOW'] = 60
+passwords = PasswordHasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS'],
+                           app.config['HASH_WORKERS'], app.config['HASH_QUEUE_LIMIT'])
+auth_throttle = LoginThrottle(app.config['AUTH_RATE_LIMIT'], app.config['AUTH_RATE_WINDOW'])
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Per-process cache of user items so load_user skips most get_item calls
+app.config['USER_CACHE_SIZE'] = 4096
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+# Optionally trust a snapshot of the user's fields in the signed session
+# cookie for this many seconds, so most requests need no DynamoDB read at all.
+# Admin rights are left out of it and looked up, through the user cache,
+# when a page or route checks them.
+app.config['USER_SESSION_SNAPSHOT'] = os.environ.get('USER_SESSION_SNAPSHOT', '0') == '1'
+app.config['USER_SNAPSHOT_TTL'] = int(os.environ.get('USER_SNAPSHOT_TTL', 300))
+user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
 # ---------------- USER MODEL ----------------
 class User(UserMixin):
     def __init__(self, email, username, password, is_admin=False):
@@ -50,38 +127,75 @@ class User(UserMixin):
         self.email = email
         self.username = username
         self.password = password
-        self.is_admin = is_admin
+        # None until looked up (users rebuilt from the session snapshot)
+        self._is_admin = is_admin
+
+    @property
+    def is_admin(self):
+        if self._is_admin is None:
+            item = get_user_item(self.email)
+            self._is_admin = bool(item and item.get('is_admin', False))
+        return self._is_admin
+
+def get_user_item(email):
+    """The user's item from the per-process cache or DynamoDB; None if missing or unreadable."""
+    item = user_cache.get(email)
+    if item is None:
+        try:
+            item = users_table.get_item(Key={'email': email}).get('Item')
+        except Exception as e:
+            print("User load error:", e)
+            return None
+        if not item:
+            return None
+        user_cache.set(email, item)
+    return item
+
+def save_user_snapshot(user):
+    # No is_admin: a promotion or demotion must not wait for the snapshot to expire
+    session['user_snapshot'] = {
+        'email': user.email,
+        'username': user.username,
+        'at': time.time()
+    }
+
+def user_from_snapshot(email):
+    snapshot = session.get('user_snapshot')
+    if not app.config['USER_SESSION_SNAPSHOT'] or not snapshot or snapshot.get('email') != email:
+        return None
+    if time.time() - snapshot.get('at', 0) > app.config['USER_SNAPSHOT_TTL']:
+        return None
+    # The password hash is never put in the cookie; nothing after login needs it
+    return User(snapshot['email'], snapshot['username'], None, None)
 
 @login_manager.user_loader
 def load_user(email):
-    try:
-        response = users_table.get_item(Key={'email': email})
-        user = response.get('Item')
-        if user:
-            return User(
-                user['email'],
-                user['username'],
-                user['password'],
-                user.get('is_admin', False)
-            )
-    except Exception as e:
-        print("User load error:", e)
-    return None
+    user = user_from_snapshot(email)
+    if user:
+        return user
+
+    item = get_user_item(email)
+    if item is None:
+        return None
+
+    user = User(
+        item['email'],
+        item['username'],
+        item['password'],
+        item.get('is_admin', False)
+    )
+    if app.config['USER_SESSION_SNAPSHOT']:
+        save_user_snapshot(user)
+    return user
 
 # ---------------- AWS HELPERS ----------------
-def send_sns(subject, message):
-    try:
-        sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=subject,
-            Message=message
-        )
-    except ClientError as e:
-        print("SNS Error:", e)
+def send_sns(subject, message, coalesce=None):
+    outbox.publish(subject, message, coalesce)
 
 def log_admin_action(message):
-    logs_table.put_item(Item={
+    outbox.log({
         'log_id': str(uuid.uuid4()),
+        'kind': 'log',
         'message': message,
         'timestamp': datetime.utcnow().isoformat()
     })
@@ -122,6 +236,7 @@ def contact():
 
 # ---------------- AUTH ROUTES ----------------
 @app.route('/signup', methods=['GET', 'POST'])
+@throttled(auth_throttle, 'signup.html')
 def signup():
     if request.method == 'POST':
         email = request.form['email']
@@ -132,13 +247,13 @@ def signup():
 
         users_table.put_item(Item={
             'email': email,
+            'kind': 'user',
             'username': request.form['username'],
-            'password': bcrypt.generate_password_hash(
-                request.form['password']
-            ).decode(),
+            'password': passwords.hash(request.form['password']),
             'is_admin': False
         })
 
+        user_cache.pop(email)
         send_sns("New Signup", f"{email} registered")
         flash('Account created successfully!', 'success')
         return redirect(url_for('login'))
@@ -146,6 +261,7 @@ def signup():
     return render_template('signup.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@throttled(auth_throttle, 'login.html')
 def login():
     if request.method == 'POST':
         response = users_table.get_item(
@@ -153,17 +269,31 @@ def login():
         )
         user = response.get('Item')
 
-        if user and bcrypt.check_password_hash(
+        if user and passwords.check(
             user['password'],
             request.form['password']
         ):
-            login_user(User(
+            if passwords.needs_rehash(user['password']):
+                try:
+                    user['password'] = passwords.hash(request.form['password'])
+                    users_table.update_item(
+                        Key={'email': user['email']},
+                        UpdateExpression="SET password = :p",
+                        ExpressionAttributeValues={':p': user['password']}
+                    )
+                except (HasherBusy, ClientError) as e:
+                    print("Password rehash skipped:", e)
+            user_cache.set(user['email'], user)
+            logged_in = User(
                 user['email'],
                 user['username'],
                 user['password'],
                 user.get('is_admin', False)
-            ))
-            send_sns("User Login", f"{user['username']} logged in")
+            )
+            login_user(logged_in)
+            if app.config['USER_SESSION_SNAPSHOT']:
+                save_user_snapshot(logged_in)
+            send_sns("User Login", f"{user['username']} logged in", coalesce='login')
             return redirect(url_for('home'))
 
         flash('Invalid credentials', 'danger')
@@ -183,6 +313,7 @@ def reset_request():
 @app.route('/logout')
 @login_required
 def logout():
+    session.pop('user_snapshot', None)
     logout_user()
     return redirect(url_for('splash'))
 
@@ -198,6 +329,58 @@ def home():
 def admin():
     return redirect(url_for('admin_dashboard'))
 
+def encode_cursor(key):
+    if not key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(key, dict) or not all(isinstance(v, str) for v in key.values()):
+        return None
+    return key
+
+def query_page(table, index, condition, cursor, newest_first=False):
+    """One page of an index query and the cursor for the next one."""
+    params = {
+        'IndexName': index,
+        'KeyConditionExpression': condition,
+        'Limit': app.config['ADMIN_PAGE_SIZE'],
+        'ScanIndexForward': not newest_first
+    }
+    start = decode_cursor(cursor)
+    if start:
+        params['ExclusiveStartKey'] = start
+    response = table.query(**params)
+    return response.get('Items', []), encode_cursor(response.get('LastEvaluatedKey'))
+
+def user_total():
+    """Users in the table, from DescribeTable at most every TABLE_STATS_TTL seconds."""
+    total = table_stats.get('users')
+    if total is None:
+        # DynamoDB itself only updates ItemCount about every six hours
+        try:
+            users_table.reload()
+            total = users_table.item_count
+        except ClientError as e:
+            print("DescribeTable error:", e)
+            return None
+        table_stats.set('users', total)
+    return total
+
+def admin_total():
+    try:
+        item = logs_table.get_item(Key=ADMIN_COUNT_KEY).get('Item')
+    except ClientError as e:
+        print("Admin count error:", e)
+        return None
+    return int(item['count']) if item else None
+
 @app.route('/admin_dashboard')
 @login_required
 def admin_dashboard():
@@ -205,24 +388,91 @@ def admin_dashboard():
         flash('Admins only!', 'danger')
         return redirect(url_for('home'))
 
+    search = request.args.get('q', '').strip()
+    condition = Key('kind').eq('user')
+    if search:
+        condition = condition & Key('email').begins_with(search)
+    users, next_cursor = query_page(
+        users_table, USERS_EMAIL_INDEX, condition, request.args.get('after')
+    )
+    logs, next_logs_cursor = query_page(
+        logs_table, LOGS_TIME_INDEX, Key('kind').eq('log'),
+        request.args.get('logs_after'), newest_first=True
+    )
+
     return render_template(
         'admin_dashboard.html',
-        users=users_table.scan().get('Items', []),
-        logs=logs_table.scan().get('Items', [])
+        users=users,
+        logs=logs,
+        stats={'total': user_total(), 'admins': admin_total()},
+        search=search,
+        next_cursor=next_cursor,
+        next_logs_cursor=next_logs_cursor
     )
 
+@app.cli.command('backfill-index-keys')
+def backfill_index_keys():
+    """Add the 'kind' index key to users and logs written before it existed."""
+    for table, kind, key in ((users_table, 'user', 'email'), (logs_table, 'log', 'log_id')):
+        params = {'ProjectionExpression': '#k, #kind', 'ExpressionAttributeNames': {'#k': key, '#kind': 'kind'}}
+        updated = 0
+        while True:
+            response = table.scan(**params)
+            for item in response.get('Items', []):
+                if 'kind' not in item:
+                    table.update_item(
+                        Key={key: item[key]},
+                        UpdateExpression="SET #kind = :k",
+                        ExpressionAttributeNames={'#kind': 'kind'},
+                        ExpressionAttributeValues={':k': kind}
+                    )
+                    updated += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        print(f"{table.name}: {updated} items updated")
+
+@app.cli.command('recount-admins')
+def recount_admins():
+    """Rebuild the admin counter from a full scan of the users table."""
+    params = {'ProjectionExpression': 'is_admin'}
+    admins = 0
+    while True:
+        response = users_table.scan(**params)
+        admins += sum(1 for item in response.get('Items', []) if item.get('is_admin'))
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    logs_table.put_item(Item={**ADMIN_COUNT_KEY, 'kind': 'counter', 'count': admins})
+    print(f"{admins} admins")
+
 @app.route('/make_admin/<email>', methods=['POST'])
 @login_required
 def make_admin(email):
     if not current_user.is_admin:
         return redirect(url_for('home'))
 
-    users_table.update_item(
-        Key={'email': email},
-        UpdateExpression="SET is_admin = :a",
-        ExpressionAttributeValues={':a': True}
+    # Only an existing non-admin is promoted, so the counter moves once per promotion
+    try:
+        users_table.update_item(
+            Key={'email': email},
+            UpdateExpression="SET is_admin = :a",
+            ConditionExpression=Attr('email').exists() & (Attr('is_admin').not_exists() | Attr('is_admin').eq(False)),
+            ExpressionAttributeValues={':a': True}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        flash(f'{email} is not a user or is already an admin.', 'warning')
+        return redirect(url_for('admin_dashboard'))
+    logs_table.update_item(
+        Key=ADMIN_COUNT_KEY,
+        UpdateExpression="SET #kind = :k ADD #count :one",
+        ExpressionAttributeNames={'#kind': 'kind', '#count': 'count'},
+        ExpressionAttributeValues={':k': 'counter', ':one': 1}
     )
 
+    user_cache.pop(email)
     log_admin_action(f"{email} promoted to admin")
     return redirect(url_for('admin_dashboard'))
 
@@ -234,20 +484,20 @@ def create():
         file = request.files['file']
         filename = secure_filename(file.filename)
 
-        input_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(input_path)
+        data = file.read()
+        store.put_bytes('uploads', filename, data)
 
-        time.sleep(0.2)
-        img = cv2.imread(input_path)
+        img = imaging.decode_bytes(data)
         img = cv2.fastNlMeansDenoisingColored(
             img, None, 10, 10, 7, 21
         )
 
         output_name = f"heritage_{filename}"
-        cv2.imwrite(
-            os.path.join(PROCESSED_FOLDER, output_name),
+        imaging.write_image(
+            store.path('processed', output_name),
             img
         )
+        store.save('processed', output_name)
 
         return render_template(
             'create.html',
@@ -259,6 +509,8 @@ def create():
 @app.route('/download/<filename>')
 @login_required
 def download(filename):
+    if store.remote and not os.path.isfile(store.path('processed', filename)):
+        return redirect(store.download_url('processed', filename, as_attachment=True))
     return send_from_directory(
         PROCESSED_FOLDER,
         filename,
@@ -0,0 +1,94 @@
+"""
+Helpers for /process_batch: reading many uploads and streaming a ZIP back.
+
+The response archive is written into a small buffer that is drained after
+every member, so only one processed image is held at a time no matter how
+many are in the batch.
+"""
+
+import io
+import json
+import os
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+
+class BatchError(ValueError):
+    pass
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink; ZipFile falls back to data descriptors for it."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_inputs(uploads, max_files, max_member_bytes):
+    """Yield (name, bytes) for each (name, bytes) upload, expanding ZIPs lazily."""
+    count = 0
+    for name, data in uploads:
+        name = secure_filename(name or '')
+        if not name:
+            continue
+        if not name.lower().endswith('.zip'):
+            count += 1
+            if count > max_files:
+                raise BatchError(f'A batch may contain at most {max_files} images.')
+            yield name, data
+            continue
+
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            raise BatchError(f'{name} is not a valid ZIP archive.')
+        for member in archive.infolist():
+            member_name = secure_filename(os.path.basename(member.filename))
+            if member.is_dir() or not member_name:
+                continue
+            count += 1
+            if count > max_files:
+                raise BatchError(f'A batch may contain at most {max_files} images.')
+            if member.file_size > max_member_bytes:
+                raise BatchError(f'{member_name} is larger than the upload limit.')
+            yield member_name, archive.read(member)
+
+
+def stream_zip(results):
+    """Yield ZIP bytes for (name, data or None, error) tuples as they arrive.
+
+    A manifest.json listing every input and its outcome is appended last.
+    """
+    buffer = _StreamBuffer()
+    manifest = []
+    seen = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data, error in results:
+            if error is not None:
+                manifest.append({'file': name, 'status': 'failed', 'error': error})
+                continue
+            stem, ext = os.path.splitext(name)
+            out_name, n = name, 1
+            while out_name in seen:
+                out_name = f'{stem}_{n}{ext}'
+                n += 1
+            seen.add(out_name)
+            # Images are already compressed; storing them avoids wasted CPU
+            archive.writestr(out_name, data)
+            manifest.append({'file': name, 'status': 'done', 'output': out_name})
+            yield buffer.drain()
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    yield buffer.drain()
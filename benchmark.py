@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Benchmark every image operation across image sizes.
+
+Each case encodes a synthetic image, then times decode, compute and encode
+separately. Memory is measured as peak RSS (VmHWM, or ru_maxrss) in a fresh
+subprocess per case, since tracemalloc cannot see OpenCV's native
+allocations: `peak_rss_mb` is the subprocess's high-water mark and
+`compute_rss_mb` how far the compute step raised it above the decoded
+input. Results are written as JSON so runs can be diffed between releases.
+
+Usage:
+    python benchmark.py                          # all operations, default sizes
+    python benchmark.py --sizes 640x480 --ops sketch detail
+    python benchmark.py --output bench.json --compare previous.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Add the project directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import imaging
+
+DEFAULT_SIZES = ['640x480', '1920x1080', '2500x1667']
+HERITAGE = 'heritage'
+
+
+def synthetic_image(width, height, seed=0):
+    """A smooth gradient with shapes and noise, so edges and denoise have work to do."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.dstack([np.broadcast_to(x, (height, width)),
+                     np.broadcast_to(y, (height, width)),
+                     (x + y) / 2]).astype(np.uint8)
+    for _ in range(20):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(img, center, int(rng.integers(10, max(11, width // 8))), color, -1)
+    noise = rng.normal(0, 12, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def measure(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def compute_func(operation, img):
+    if operation == HERITAGE:
+        return lambda: imaging.heritage(img)
+    return lambda: imaging.OPERATIONS[operation](img)
+
+
+def max_rss_mb():
+    # On Linux ru_maxrss survives exec and would include the parent's peak;
+    # VmHWM belongs to the new address space
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other systems kilobytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def rss_case(operation, path):
+    """Run one compute in this (fresh) process and print its peak RSS as JSON."""
+    with open(path, 'rb') as f:
+        img = imaging.decode_bytes(f.read())
+    before = max_rss_mb()
+    compute_func(operation, img)()
+    after = max_rss_mb()
+    print(json.dumps({'peak_rss_mb': round(after, 1), 'compute_rss_mb': round(after - before, 1)}))
+
+
+def measure_rss(operation, data, ext):
+    # ru_maxrss only ever grows, so each case needs a process of its own
+    with tempfile.NamedTemporaryFile(suffix=ext) as f:
+        f.write(data)
+        f.flush()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--rss-case', operation, f.name],
+                                check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def bench_case(operation, img, repeat, ext):
+    ok, encoded = cv2.imencode(ext, img)
+    data = encoded.tobytes()
+
+    decode_ms, decoded = measure(lambda: imaging.decode_bytes(data), repeat)
+    compute_ms, processed = measure(compute_func(operation, decoded), repeat)
+    memory = measure_rss(operation, data, ext)
+
+    encode = lambda: cv2.imencode(ext, processed)[1].tobytes()
+    encode_ms, output = measure(encode, repeat)
+
+    return {
+        'operation': operation,
+        'width': img.shape[1],
+        'height': img.shape[0],
+        'format': ext.lstrip('.'),
+        'decode_ms': round(decode_ms, 2),
+        'compute_ms': round(compute_ms, 2),
+        'encode_ms': round(encode_ms, 2),
+        'total_ms': round(decode_ms + compute_ms + encode_ms, 2),
+        **memory,
+        'input_bytes': len(data),
+        'output_bytes': len(output)
+    }
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    key = lambda r: (r['operation'], r['width'], r['height'], r['format'])
+    before = {key(r): r for r in previous['results']}
+    print(f"\n{'operation':<16}{'size':>12}{'before ms':>12}{'after ms':>12}{'change':>9}")
+    for r in results:
+        old = before.get(key(r))
+        if not old:
+            continue
+        change = (r['total_ms'] - old['total_ms']) / old['total_ms'] * 100 if old['total_ms'] else 0.0
+        print(f"{r['operation']:<16}{r['width']:>6}x{r['height']:<5}"
+              f"{old['total_ms']:>12.1f}{r['total_ms']:>12.1f}{change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Nirvana Heritage image operations.')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='WIDTHxHEIGHT values')
+    parser.add_argument('--ops', nargs='+', default=list(imaging.OPERATIONS) + [HERITAGE],
+                        help='operations to run (default: all, plus the /create heritage path)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the median is reported')
+    parser.add_argument('--format', default='jpg', choices=['jpg', 'png'], help='input/output encoding')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    parser.add_argument('--rss-case', nargs=2, metavar=('OPERATION', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.rss_case:
+        rss_case(*args.rss_case)
+        return
+
+    unknown = [op for op in args.ops if op != HERITAGE and op not in imaging.OPERATIONS]
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(unknown)}")
+
+    results = []
+    for size in args.sizes:
+        width, height = (int(v) for v in size.lower().split('x'))
+        img = synthetic_image(width, height)
+        for operation in args.ops:
+            result = bench_case(operation, img, args.repeat, '.' + args.format)
+            results.append(result)
+            print(f"{operation:<16}{width:>6}x{height:<5} decode {result['decode_ms']:>8.1f} ms  "
+                  f"compute {result['compute_ms']:>9.1f} ms  encode {result['encode_ms']:>8.1f} ms  "
+                  f"peak RSS {result['peak_rss_mb']:>7.1f} MB (+{result['compute_rss_mb']:.1f})", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'machine': platform.machine(),
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,25 +4,54 @@ from dotenv import load_dotenv
 # Load variables from .env if it exists
 load_dotenv()
 
+def engine_options(uri):
+    """Connection pool settings for the configured database."""
+    if uri.startswith('sqlite'):
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}
+        # SQLite allows one writer at a time; a few pooled connections are
+        # plenty, and each waits on the lock via PRAGMA busy_timeout
+        return {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 30}
+    return {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    }
+
 class Config:
     """Base configuration."""
     # Security
-    SECRET_KEY = os.environ.get('SECRET_KEY', 'nirvana_heritage_fallback_key_2026')
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'nirvana_heritage_secure_2026')
     
     # Database
     # Fallback to local sqlite if DATABASE_URL isn't set in .env
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 100))
     
     # File Management
-    UPLOAD_FOLDER = os.path.join('static', 'uploads')
-    PROCESSED_FOLDER = os.path.join('static', 'processed')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB Upload Limit
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join('static', 'uploads'))
+    PROCESSED_FOLDER = os.environ.get('PROCESSED_FOLDER', os.path.join('static', 'processed'))
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # 64MB Upload Limit
+
+    # Storage backend: 'local' (the folders above) or 's3', where the bucket is
+    # the store and the folders become a per-node cache. S3_ENDPOINT_URL may
+    # name MinIO or a file:// directory for the fake_s3.py stand-in.
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    PRESIGN_EXPIRY = int(os.environ.get('PRESIGN_EXPIRY', 3600))
     
     # Email Configuration (Nirvana Heritage Support)
-    MAIL_SERVER = 'smtp.googlemail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'e23ai023@sdnbvc.edu.in')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'jbny qhgn kljc ajmf')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_USERNAME', 'e23ai023@sdnbvc.edu.in')
@@ -32,9 +61,18 @@ class ProductionConfig(Config):
     DEBUG = False
     # In production, you'd strictly require the SECRET_KEY to be in .env
     SESSION_COOKIE_SECURE = True
+    # Behind a load balancer the client address comes from this header, as
+    # appended by the last TRUSTED_PROXIES hops (the per-IP auth throttle uses it)
     REMOTE_ADDR_HEADER = 'X-Forwarded-For'
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1))
 
 class DevelopmentConfig(Config):
     """Development specific config."""
     DEBUG = True
-    # Development often uses local sqlite and allows simple debugging
\ No newline at end of file
+    # Development often uses local sqlite and allows simple debugging
+
+config_by_name = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'production': ProductionConfig
+}
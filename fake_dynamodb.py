@@ -0,0 +1,156 @@
+"""
+In-process stand-in for the subset of the boto3 DynamoDB resource that app_aws.py uses.
+
+Select it with DYNAMODB_ENDPOINT_URL=memory://, or pass an instance where a
+`boto3.resource('dynamodb')` is expected. Tables are created on first use
+and live for the life of the process; the attribute named by the first key
+or item a table sees is taken as its hash key. Index names are read as
+`<hash key>-<range key>-index`, the convention app_aws.py follows, and
+only the expressions app_aws.py writes are understood: SET and ADD
+updates, and =, <>, begins_with, attribute_exists/attribute_not_exists,
+AND and OR conditions.
+"""
+
+import copy
+import re
+import threading
+
+from botocore.exceptions import ClientError
+
+
+def _condition_failed():
+    return ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                  'Message': 'The conditional request failed'}}, 'UpdateItem')
+
+
+def _matches(item, condition):
+    """Evaluate a boto3.dynamodb.conditions expression against an item."""
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return all(_matches(item, value) for value in values)
+    if operator == 'OR':
+        return any(_matches(item, value) for value in values)
+    name = values[0].name
+    if operator == 'attribute_exists':
+        return name in item
+    if operator == 'attribute_not_exists':
+        return name not in item
+    if operator == '=':
+        return item.get(name) == values[1]
+    if operator == '<>':
+        return item.get(name) != values[1]
+    if operator == 'begins_with':
+        return isinstance(item.get(name), str) and item[name].startswith(values[1])
+    raise NotImplementedError(f'Condition operator {operator!r}')
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeTable:
+    def __init__(self, name):
+        self.name = name
+        self.key_name = None
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        ((name, value),) = key.items()
+        self.key_name = self.key_name or name
+        return value
+
+    @property
+    def item_count(self):
+        return len(self._items)
+
+    def reload(self):
+        """DescribeTable; item_count is always current here."""
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            item = self._items.get(self._key(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None):
+        key_name = self.key_name or next(iter(Item))
+        with self._lock:
+            key = self._key({key_name: Item[key_name]})
+            if ConditionExpression is not None and not _matches(self._items.get(key, {}), ConditionExpression):
+                raise _condition_failed()
+            self._items[key] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key):
+        with self._lock:
+            self._items.pop(self._key(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues='NONE'):
+        values = ExpressionAttributeValues or {}
+        names = ExpressionAttributeNames or {}
+        with self._lock:
+            key = self._key(Key)
+            item = copy.deepcopy(self._items.get(key, dict(Key)))
+            if ConditionExpression is not None and not _matches(self._items.get(key, {}), ConditionExpression):
+                raise _condition_failed()
+            for action, clause in re.findall(r'(SET|ADD)\s+(.*?)(?=\s+(?:SET|ADD)\s|$)', UpdateExpression):
+                for part in clause.split(','):
+                    if action == 'SET':
+                        attribute, value = (s.strip() for s in part.split('='))
+                        item[names.get(attribute, attribute)] = values[value]
+                    else:
+                        attribute, value = part.split()
+                        attribute = names.get(attribute, attribute)
+                        item[attribute] = item.get(attribute, 0) + values[value]
+            self._items[key] = item
+            return {'Attributes': copy.deepcopy(item)} if ReturnValues != 'NONE' else {}
+
+    def query(self, IndexName, KeyConditionExpression, Limit=None, ScanIndexForward=True,
+              ExclusiveStartKey=None, Select=None, **kwargs):
+        hash_key, range_key = IndexName[:-len('-index')].split('-', 1)
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self._items.values()
+                     if range_key in item and _matches(item, KeyConditionExpression)]
+        if Select == 'COUNT':
+            return {'Count': len(items)}
+        items.sort(key=lambda item: (item[range_key], item[self.key_name]), reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            start = (ExclusiveStartKey[range_key], ExclusiveStartKey[self.key_name])
+            after = (lambda k: k > start) if ScanIndexForward else (lambda k: k < start)
+            items = [item for item in items if after((item[range_key], item[self.key_name]))]
+        response = {'Items': items[:Limit] if Limit else items}
+        if Limit and len(items) > Limit:
+            last = items[Limit - 1]
+            response['LastEvaluatedKey'] = {
+                hash_key: last[hash_key], range_key: last[range_key], self.key_name: last[self.key_name]}
+        return response
+
+    def scan(self, **kwargs):
+        with self._lock:
+            return {'Items': [copy.deepcopy(item) for item in self._items.values()]}
+
+    def batch_writer(self):
+        return _BatchWriter(self)
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def Table(self, name):
+        with self._lock:
+            return self._tables.setdefault(name, FakeTable(name))
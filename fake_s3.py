@@ -0,0 +1,85 @@
+"""
+Local stand-in for the subset of the boto3 S3 client that storage.py uses.
+
+Objects are plain files under `root/<bucket>/<key>`. Select it with
+STORAGE_BACKEND=s3 and S3_ENDPOINT_URL=file:///some/dir, or pass an
+instance to S3Storage directly. Presigned URLs point at the files
+themselves, so they are only useful for checking what would be signed.
+"""
+
+import os
+import shutil
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+def _not_found(operation):
+    return ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, operation)
+
+
+class _ListPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix=''):
+        base = os.path.join(self.client.root, Bucket)
+        contents = []
+        for folder, _, files in os.walk(base):
+            for name in files:
+                path = os.path.join(folder, name)
+                key = os.path.relpath(path, base).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    stat = os.stat(path)
+                    contents.append({
+                        'Key': key,
+                        'Size': stat.st_size,
+                        'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+                    })
+        yield {'Contents': sorted(contents, key=lambda obj: obj['Key'])}
+
+
+class FakeS3Client:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        path = os.path.join(self.root, bucket, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        with open(self._path(bucket, key), 'wb') as f:
+            shutil.copyfileobj(fileobj, f)
+
+    def upload_file(self, filename, bucket, key, Config=None):
+        shutil.copyfile(filename, self._path(bucket, key))
+
+    def download_file(self, bucket, key, filename, Config=None):
+        path = self._path(bucket, key)
+        if not os.path.isfile(path):
+            raise _not_found('HeadObject')
+        shutil.copyfile(path, filename)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise _not_found('HeadObject')
+        return {'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return _ListPaginator(self)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        return 'file://' + self._path(Params['Bucket'], Params['Key'])
+
+    def generate_presigned_post(self, bucket, key, Fields=None, Conditions=None, ExpiresIn=3600):
+        return {'url': 'file://' + os.path.join(self.root, bucket), 'fields': {'key': key, **(Fields or {})}}
@@ -0,0 +1,767 @@
+"""
+Image operations shared by the Nirvana Heritage processing routes.
+
+Every operation takes a BGR ndarray and returns a BGR ndarray, so any
+sequence of them can be run on a single in-memory image.
+"""
+
+import functools
+import hashlib
+import io
+import itertools
+import os
+import tempfile
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import metrics
+from ttl_cache import TTLCache
+
+# Largest side (px) the processing routes work at
+MAX_SIDE = 2500
+
+# Uploads above this many pixels are refused before decoding
+MAX_IMAGE_PIXELS = 80_000_000
+
+# read_dimensions enforces MAX_IMAGE_PIXELS itself, so Pillow's warning is noise
+warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+# Extensions OpenCV has no writer for, mapped to the codec to use
+ENCODE_EXT = {'.jfif': '.jpg'}
+
+# Extensions whose encoded form decodes back to the exact same pixels
+LOSSLESS_EXT = {'.png', '.bmp', '.tif', '.tiff'}
+
+
+# --- I/O ---
+# os.umask can only be read by setting it, so read it once at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextmanager
+def atomic_write(path):
+    """Yield a temp path next to `path` and rename it into place on success.
+
+    Readers therefore see either the previous file or the complete new one,
+    never a partially written file.
+    """
+    folder, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder or '.', prefix='.tmp_', suffix=os.path.splitext(name)[1])
+    os.close(fd)
+    try:
+        yield tmp_path
+        # mkstemp creates 0600; give the file the mode open() would, so a web server running as another user can read it
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def read_dimensions(path):
+    """Return (width, height, format) from the file header without decoding.
+
+    `path` may also be a file-like object holding the encoded bytes.
+
+    Returns None when Pillow cannot identify the file, leaving the decision
+    to OpenCV. Raises ImageTooLarge above MAX_IMAGE_PIXELS.
+    """
+    try:
+        with Image.open(path) as im:
+            width, height = im.size
+            fmt = im.format
+    except Image.DecompressionBombError:
+        raise ImageTooLarge('Artifact dimensions exceed the studio limit.')
+    except (OSError, ValueError):
+        return None
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f'Artifact is {width}x{height}; the studio limit is {MAX_IMAGE_PIXELS // 1_000_000} MP.')
+    return width, height, fmt
+
+
+def reduced_decode_flag(width, height, fmt, max_side):
+    """Pick the largest IMREAD_REDUCED_COLOR_* that still decodes >= max_side.
+
+    Only JPEG decoders scale during decode (in the DCT); for other formats a
+    reduced flag still allocates the full image first, so they decode as-is.
+    """
+    if fmt != 'JPEG':
+        return cv2.IMREAD_COLOR
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) / factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+class ImageCache:
+    """Per-process LRU of decoded images keyed by (path, mtime, size, max_side)."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(path, max_side):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, max_side)
+
+    def get(self, path, max_side=None):
+        try:
+            stamp = self._stamp(path, max_side)
+        except OSError:
+            return None
+        with self._lock:
+            img = self._entries.get(stamp)
+            if img is not None:
+                self._entries.move_to_end(stamp)
+            return img
+
+    def put(self, path, img, max_side=None):
+        if img.nbytes > self.max_bytes:
+            return
+        stamp = self._stamp(path, max_side)
+        # Cached arrays are shared between requests, so they must not change
+        img.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(stamp, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[stamp] = img
+            self.nbytes += img.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+image_cache = ImageCache()
+
+
+def read_image(path, max_side=None):
+    """Decode an image, served from the per-process cache when unchanged.
+
+    With max_side set, the header is checked first and JPEGs are decoded at
+    a reduced scale, so the largest buffer allocated stays close to
+    max_side instead of the full upload resolution; the result is then
+    limited to max_side. The returned array is read-only; operations always
+    return new arrays.
+    """
+    wait_for_write(path)
+    with metrics.stage('cache'):
+        img = image_cache.get(path, max_side)
+    if img is not None:
+        return img
+
+    flag = cv2.IMREAD_COLOR
+    with metrics.stage('header'):
+        header = read_dimensions(path)
+    if max_side and header:
+        flag = reduced_decode_flag(*header, max_side)
+    with metrics.stage('decode'):
+        img = cv2.imread(path, flag)
+    if img is None:
+        return None
+    metrics.add('bytes_read', os.path.getsize(path))
+    metrics.add('pixels', header[0] * header[1] if header else img.shape[0] * img.shape[1])
+    if max_side:
+        with metrics.stage('resize'):
+            img = limit_size(img, max_side)
+    image_cache.put(path, img, max_side)
+    return img
+
+
+def decode_bytes(data, flag=cv2.IMREAD_COLOR):
+    """Decode an encoded image held in memory; None if it is unreadable."""
+    buf = np.frombuffer(data, np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, flag)
+
+
+_persist_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='persist')
+
+
+def persist_bytes(path, data):
+    """Atomically write raw bytes to `path` on a background thread."""
+    def write():
+        with atomic_write(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+    return _persist_pool.submit(write)
+
+
+# --- ENCODING ---
+# Output formats clients can ask for, by name
+OUTPUT_FORMATS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+
+
+def available_formats():
+    """Output formats this OpenCV build can actually write."""
+    return [name for name, ext in OUTPUT_FORMATS.items() if cv2.haveImageWriter('x' + ext)]
+
+
+def output_name(filename, fmt=None):
+    """Swap the extension of `filename` for the requested output format, if any."""
+    if not fmt:
+        return filename
+    return os.path.splitext(filename)[0] + OUTPUT_FORMATS[fmt]
+
+
+def encode_params(ext, quality=None, png_compression=None):
+    """Return the OpenCV codec extension and imwrite params for an output.
+
+    None leaves the codec default in place.
+    """
+    codec = ENCODE_EXT.get(ext.lower(), ext.lower())
+    params = []
+    if quality is not None:
+        if codec in ('.jpg', '.jpeg', '.jpe'):
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif codec == '.webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        elif codec == '.avif':
+            params = [cv2.IMWRITE_AVIF_QUALITY, quality]
+    if codec == '.png' and png_compression is not None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return codec, params
+
+
+def encode_image(img, ext, quality=None, png_compression=None):
+    codec, params = encode_params(ext, quality, png_compression)
+    with metrics.stage('encode'):
+        ok, buf = cv2.imencode(codec, img, params)
+    if not ok:
+        raise ValueError(f'Could not encode image as {ext}')
+    return buf
+
+
+def write_image(path, img, quality=None, png_compression=None):
+    """Atomically encode `img` to `path` and prime the cache for lossless formats."""
+    ext = os.path.splitext(path)[1].lower()
+    buf = encode_image(img, ext, quality, png_compression)
+    with metrics.stage('write'):
+        with atomic_write(path) as tmp_path:
+            buf.tofile(tmp_path)
+    metrics.add('bytes_written', buf.size)
+    if ext in LOSSLESS_EXT and max(img.shape[:2]) <= MAX_SIDE:
+        # Loading this file for processing would return exactly `img`
+        image_cache.put(path, img, MAX_SIDE)
+
+
+# Encodes run on their own pool, and only as many as it has threads are
+# accepted at once; past that write_image_async encodes on the caller's
+# thread, so decoded images cannot pile up in memory behind a slow disk.
+WRITE_WORKERS = 2
+_write_pool = ThreadPoolExecutor(max_workers=WRITE_WORKERS, thread_name_prefix='encode')
+_write_slots = threading.BoundedSemaphore(WRITE_WORKERS)
+
+# Writes still in flight in this process: abspath -> (token, future)
+_pending_writes = {}
+_pending_lock = threading.Lock()
+
+# A marker older than this is left over from a crashed writer
+PENDING_TIMEOUT = 30
+
+
+def _pending_marker(path):
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f'.{name}.pending')
+
+
+def write_image_async(path, img, quality=None, png_compression=None, callback=None):
+    """Encode and write `img` on the encode pool so the request can return.
+
+    A marker file is created before returning; wait_for_write holds readers
+    back until the output is in place, in this or any other worker process
+    sharing the folder. `callback` runs once the file has been written.
+    When every encode thread is busy the write happens before returning.
+    """
+    if not _write_slots.acquire(blocking=False):
+        metrics.add('sync_writes', 1)
+        write_image(path, img, quality, png_compression)
+        if callback:
+            callback()
+        future = Future()
+        future.set_result(None)
+        return future
+
+    key = os.path.abspath(path)
+    marker = _pending_marker(path)
+    try:
+        open(marker, 'wb').close()
+    except OSError:
+        _write_slots.release()
+        raise
+    labels = metrics.current_labels()
+    token = object()
+
+    def job():
+        collector = metrics.begin()
+        metrics.annotate(**labels)
+        try:
+            write_image(path, img, quality, png_compression)
+            if callback:
+                callback()
+        except Exception as e:
+            print('Async write error:', path, e)
+            raise
+        finally:
+            metrics.end()
+            metrics.registry.record(collector, 'async_write', 200)
+            _write_slots.release()
+            with _pending_lock:
+                if _pending_writes.get(key, (None,))[0] is token:
+                    del _pending_writes[key]
+            try:
+                os.remove(marker)
+            except OSError:
+                pass
+
+    with _pending_lock:
+        future = _write_pool.submit(job)
+        _pending_writes[key] = (token, future)
+    return future
+
+
+def is_pending(path):
+    """True while a write_image_async for `path` is in flight in any worker."""
+    return os.path.abspath(path) in _pending_writes or os.path.exists(_pending_marker(path))
+
+
+def wait_for_write(path, timeout=PENDING_TIMEOUT):
+    """Block until an in-flight write_image_async for `path` has finished."""
+    with _pending_lock:
+        entry = _pending_writes.get(os.path.abspath(path))
+    if entry is not None:
+        try:
+            entry[1].result(timeout)
+        except Exception:
+            pass
+        return
+
+    marker = _pending_marker(path)
+    deadline = time.monotonic() + timeout
+    while os.path.exists(marker) and time.monotonic() < deadline:
+        try:
+            if time.time() - os.path.getmtime(marker) > timeout:
+                break
+        except OSError:
+            break
+        time.sleep(0.01)
+
+
+def limit_size(img, max_side=MAX_SIDE):
+    """Downscale an image so its largest side is at most max_side."""
+    h, w = img.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+
+# --- PREVIEW PYRAMID ---
+# Editor previews run on a cached copy of the source sized to the viewport.
+# Sizes snap to these levels so nearby viewports share one decoded copy.
+PREVIEW_LEVELS = (256, 512, 1024, 2048)
+
+
+def preview_level(side):
+    """Smallest pyramid level covering `side` pixels, capped at MAX_SIDE."""
+    return min(next((level for level in PREVIEW_LEVELS if level >= side), MAX_SIDE), MAX_SIDE)
+
+
+def pyramid_image(path, side):
+    """Read-only copy of an image at the pyramid level for a `side`-pixel viewport.
+
+    A missing level is downscaled from a larger one already in the image
+    cache, so walking down the pyramid decodes the file only once.
+    """
+    level = preview_level(side)
+    wait_for_write(path)
+    img = image_cache.get(path, level)
+    if img is not None:
+        return img
+    for larger in [l for l in PREVIEW_LEVELS if l > level] + [MAX_SIDE]:
+        source = image_cache.get(path, larger)
+        if source is not None:
+            with metrics.stage('resize'):
+                img = limit_size(source, level)
+            image_cache.put(path, img, level)
+            return img
+    return read_image(path, level)
+
+
+# --- HERITAGE ENHANCE (/create) ---
+# fastNlMeansDenoisingColored(img, None, h, hColor, template, search)
+DENOISE_PARAMS = (10, 10, 7, 21)
+
+# Images with more pixels than this are denoised tile by tile
+TILED_DENOISE_MIN_PIXELS = 2_000_000
+DENOISE_TILE = 512
+
+
+def denoise(img):
+    return cv2.fastNlMeansDenoisingColored(img, None, *DENOISE_PARAMS)
+
+
+def denoise_tiled(img, tile=DENOISE_TILE, workers=None):
+    """Denoise overlapping tiles in parallel and stitch their cores together.
+
+    A denoised pixel only depends on pixels within half the search window
+    plus half the template window, so each tile is padded by that margin
+    and only its unpadded core is kept. The seams therefore match the
+    single-shot result; OpenCV releases the GIL, so threads run on separate
+    cores. `workers` defaults to every core; callers running several
+    denoises at once (the job pool) should pass their share.
+    """
+    h, w = img.shape[:2]
+    _, _, template, search = DENOISE_PARAMS
+    pad = search // 2 + template // 2
+    out = np.empty_like(img)
+
+    def run(y, x):
+        y0, x0 = max(y - pad, 0), max(x - pad, 0)
+        y1, x1 = min(y + tile + pad, h), min(x + tile + pad, w)
+        result = denoise(img[y0:y1, x0:x1])
+        ty, tx = min(tile, h - y), min(tile, w - x)
+        out[y:y + ty, x:x + tx] = result[y - y0:y - y0 + ty, x - x0:x - x0 + tx]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run, y, x) for y in range(0, h, tile) for x in range(0, w, tile)]
+        for future in futures:
+            future.result()
+    return out
+
+
+HERITAGE_COLOR = 1.2
+
+
+def heritage(img, workers=None):
+    """The /create treatment: denoise, then boost colour like ImageEnhance.Color(1.2).
+
+    The colour boost runs in place on the denoised array, so the only
+    full-size allocation is the denoise output itself. `workers` caps the
+    threads used to denoise large images tile by tile.
+    """
+    if img.shape[0] * img.shape[1] > TILED_DENOISE_MIN_PIXELS:
+        denoised = denoise_tiled(img, workers=workers)
+    else:
+        denoised = denoise(img)
+    return apply_pointwise(denoised, (('color', HERITAGE_COLOR),), out=denoised)
+
+
+def enhance_heritage(data, output_path, quality=None, png_compression=None, denoise_workers=None):
+    """Denoise and colour-enhance uploaded bytes; runs in the job process pool."""
+    img = decode_bytes(data)
+    if img is None:
+        raise ValueError('Artifact unreadable. Please try a different format.')
+    write_image(output_path, heritage(img, denoise_workers), quality, png_compression)
+    return os.path.basename(output_path)
+
+
+# --- ARTISAN OPERATIONS ---
+def dilation(img):
+    kernel = np.ones((5, 5), np.uint8)
+    return cv2.dilate(img, kernel, iterations=1)
+
+
+def edges(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    processed = cv2.Canny(gray, 100, 200)
+    return cv2.cvtColor(processed, cv2.COLOR_GRAY2BGR)
+
+
+def remove_bg(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, mask = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
+    return cv2.bitwise_and(img, img, mask=mask)
+
+
+# --- ADVANCED ROYAL OPERATIONS ---
+def find_objects(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    edged = cv2.Canny(blur, 30, 150)
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def detect_objects(img):
+    processed = img.copy()
+    cv2.drawContours(processed, find_objects(img), -1, (0, 215, 255), 2)
+    return processed
+
+
+def sketch(img):
+    gray, _ = cv2.pencilSketch(img, sigma_s=60, sigma_r=0.07, shade_factor=0.05)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def detail(img):
+    return cv2.detailEnhance(img, sigma_s=10, sigma_r=0.15)
+
+
+def sharpen(img):
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+    return cv2.filter2D(img, -1, kernel)
+
+
+def bw(img):
+    return apply_pointwise(img, ('bw',))
+
+
+def vintage(img):
+    return apply_pointwise(img, ('vintage',))
+
+
+def resize(img):
+    width = int(img.shape[1] * 0.75)
+    height = int(img.shape[0] * 0.75)
+    return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+
+# --- POINTWISE COLOUR ENGINE ---
+# bw, vintage and colour enhancement map each pixel through the same affine
+# colour transform, so each compiles to a 3x4 matrix (BGR in, BGR out).
+# A chain of them folds into as few matrices as possible: a step merges
+# into the previous stage when that stage cannot leave [0, 255], since the
+# uint8 saturation between them would then be a no-op. Every remaining
+# stage is one saturating cv2.transform pass, the last ones in place.
+GRAY_WEIGHTS = (0.114, 0.587, 0.299)  # ITU-R 601 luma in BGR order, as cvtColor and PIL use
+
+
+def _affine(matrix, offset=0.0):
+    return np.hstack([np.asarray(matrix, dtype=np.float64), np.full((3, 1), offset)])
+
+
+POINTWISE_MATRICES = {
+    'bw': _affine(np.tile(GRAY_WEIGHTS, (3, 1))),
+    'vintage': _affine([[0.272, 0.534, 0.131],
+                        [0.349, 0.686, 0.168],
+                        [0.393, 0.769, 0.189]]),
+}
+
+
+def color_matrix(factor):
+    """ImageEnhance.Color as a matrix: blend away from greyscale by `factor`.
+
+    PIL truncates the blend where cv2.transform rounds; the -0.5 offset
+    makes the two agree except where PIL's integer greyscale rounds.
+    """
+    return _affine(factor * np.eye(3) + (1 - factor) * np.tile(GRAY_WEIGHTS, (3, 1)), -0.5)
+
+
+def _stays_in_range(matrix):
+    low = np.minimum(matrix[:, :3], 0).sum(axis=1) * 255 + matrix[:, 3]
+    high = np.maximum(matrix[:, :3], 0).sum(axis=1) * 255 + matrix[:, 3]
+    return bool((low >= 0).all() and (high <= 255).all())
+
+
+@functools.lru_cache(maxsize=256)
+def compile_pointwise(steps):
+    """Fold pointwise steps (op names or ('color', factor)) into affine stages."""
+    stages = []
+    for step in steps:
+        matrix = color_matrix(step[1]) if isinstance(step, tuple) else POINTWISE_MATRICES[step]
+        if stages and _stays_in_range(stages[-1]):
+            fused = matrix[:, :3] @ stages[-1]
+            fused[:, 3] += matrix[:, 3]
+            stages[-1] = fused
+        else:
+            stages.append(matrix.copy())
+    for matrix in stages:
+        matrix.setflags(write=False)
+    return tuple(stages)
+
+
+def apply_pointwise(img, steps, out=None):
+    """Run pointwise steps on a BGR uint8 image, one pass per compiled stage."""
+    stages = compile_pointwise(tuple(steps))
+    out = cv2.transform(img, stages[0], dst=out)
+    for matrix in stages[1:]:
+        cv2.transform(out, matrix, dst=out)
+    return out
+
+
+# --- COLOUR QUANTIZATION ---
+# K-means palette reduction. The palette is fitted with mini-batch K-means
+# on a fixed random subsample of pixels, so fitting costs the same for a
+# 0.3 MP or a 40 MP image. Every pixel is then mapped to its nearest centre
+# in row chunks, keeping the distance matrix small. Palettes are cached by
+# a fingerprint of the subsample, which is identical for identical images.
+QUANTIZE_COLORS = 8
+QUANTIZE_SAMPLE = 20_000
+QUANTIZE_BATCH = 2048
+QUANTIZE_ITERATIONS = 60
+QUANTIZE_CHUNK = 262_144  # pixels per assignment chunk
+
+palette_cache = TTLCache(maxsize=256, ttl=3600)
+
+
+def _kmeans_pp(samples, k, rng):
+    """k-means++ seeding: spread the initial centres out."""
+    centers = [samples[rng.integers(len(samples))]]
+    dist = ((samples - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = dist.sum()
+        index = rng.choice(len(samples), p=dist / total) if total > 0 else rng.integers(len(samples))
+        centers.append(samples[index])
+        dist = np.minimum(dist, ((samples - samples[index]) ** 2).sum(axis=1))
+    return np.array(centers, dtype=np.float32)
+
+
+def _nearest(pixels, centers):
+    # argmin |x - c|^2 == argmin (|c|^2 - 2 x.c); |x|^2 is the same for every centre
+    scores = pixels.astype(np.float32) @ (-2 * centers.T)
+    scores += (centers ** 2).sum(axis=1)
+    return scores.argmin(axis=1)
+
+
+def fit_palette(img, k=QUANTIZE_COLORS, seed=0):
+    """BGR palette of k colours (float32, k x 3) for an image, cached per image."""
+    pixels = img.reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    samples = pixels[rng.integers(0, len(pixels), min(QUANTIZE_SAMPLE, len(pixels)))]
+    key = (img.shape, k, seed, hashlib.blake2b(samples.tobytes(), digest_size=16).digest())
+    centers = palette_cache.get(key)
+    if centers is not None:
+        return centers
+
+    samples = samples.astype(np.float32)
+    k = min(k, len(np.unique(samples, axis=0)))
+    centers = _kmeans_pp(samples, k, rng)
+    counts = np.zeros(k)
+    for _ in range(QUANTIZE_ITERATIONS):
+        batch = samples[rng.integers(0, len(samples), QUANTIZE_BATCH)]
+        labels = _nearest(batch, centers)
+        hits = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        # Per-centre learning rate 1/count, as in Sculley's mini-batch K-means
+        counts += hits
+        moved = hits > 0
+        centers[moved] += (sums[moved] - hits[moved, None] * centers[moved]) / counts[moved, None]
+    centers.setflags(write=False)
+    palette_cache.set(key, centers)
+    return centers
+
+
+def quantize(img, k=QUANTIZE_COLORS):
+    """Repaint every pixel with its nearest palette colour."""
+    centers = fit_palette(img, k)
+    palette = np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+    pixels = img.reshape(-1, 3)
+    out = np.empty_like(pixels)
+    for start in range(0, len(pixels), QUANTIZE_CHUNK):
+        chunk = pixels[start:start + QUANTIZE_CHUNK]
+        out[start:start + len(chunk)] = palette[_nearest(chunk, centers)]
+    return out.reshape(img.shape)
+
+
+ARTISAN_OPERATIONS = {
+    'dilation': dilation,
+    'edges': edges,
+    'remove_bg': remove_bg,
+}
+
+ADVANCED_OPERATIONS = {
+    'detect_objects': detect_objects,
+    'sketch': sketch,
+    'detail': detail,
+    'sharpen': sharpen,
+    'bw': bw,
+    'vintage': vintage,
+    'resize': resize,
+    'kmeans': quantize,
+}
+
+OPERATIONS = {**ARTISAN_OPERATIONS, **ADVANCED_OPERATIONS}
+
+
+# --- ANALYSIS (vector results instead of images) ---
+# Contours smaller than this bounding box (in pixels) are Canny noise
+MIN_OBJECT_BOX = 64
+# Polygon simplification tolerance, as a fraction of each contour's perimeter
+POLYGON_TOLERANCE = 0.01
+
+
+def analyze_objects(img):
+    """Bounding boxes, areas and simplified polygons of detect_objects' contours, largest first."""
+    objects = []
+    for contour in find_objects(img):
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < MIN_OBJECT_BOX:
+            continue
+        epsilon = max(1.0, POLYGON_TOLERANCE * cv2.arcLength(contour, True))
+        polygon = cv2.approxPolyDP(contour, epsilon, True)
+        objects.append({
+            'bbox': [x, y, w, h],
+            'area': round(float(cv2.contourArea(contour)), 1),
+            'polygon': polygon.reshape(-1, 2).tolist(),
+        })
+    objects.sort(key=lambda o: o['bbox'][2] * o['bbox'][3], reverse=True)
+    return {'width': img.shape[1], 'height': img.shape[0], 'objects': objects}
+
+
+ANALYSES = {
+    'detect_objects': analyze_objects,
+}
+
+
+def apply_operation(img, operation, registry=OPERATIONS):
+    """Run a single named operation; unknown names leave the image untouched."""
+    func = registry.get(operation) if isinstance(operation, str) else None
+    if func is None:
+        return img
+    with metrics.stage('compute'):
+        return func(img)
+
+
+def run_pipeline(img, operations):
+    """Run an ordered list of operations on one in-memory image."""
+    with metrics.stage('compute'):
+        # Runs of pointwise colour ops are compiled and applied together
+        for pointwise, group in itertools.groupby(operations, key=POINTWISE_MATRICES.__contains__):
+            if pointwise:
+                img = apply_pointwise(img, tuple(group))
+            else:
+                for operation in group:
+                    img = OPERATIONS[operation](img)
+    return img
+
+
+def process_encoded(data, operations, ext, quality=None, png_compression=None):
+    """Decode bytes, run a pipeline and re-encode; used by the batch pool.
+
+    Like read_image, the header is checked first (raising ImageTooLarge)
+    and JPEGs are decoded at a reduced scale when MAX_SIDE allows.
+    """
+    header = read_dimensions(io.BytesIO(data))
+    flag = reduced_decode_flag(*header, MAX_SIDE) if header else cv2.IMREAD_COLOR
+    img = decode_bytes(data, flag)
+    if img is None:
+        raise ValueError('Artifact unreadable.')
+    processed = run_pipeline(limit_size(img), operations)
+    return encode_image(processed, ext, quality, png_compression).tobytes()
@@ -0,0 +1,188 @@
+"""
+Bounded background job queue backed by a process pool.
+
+CPU-heavy work (the /create denoise) is submitted here so the request
+returns immediately with a job id that the client polls. Once the number
+of unfinished jobs reaches `max_pending`, `submit` raises QueueFull so
+the route can answer 429 instead of letting workers time out. Batch
+tasks run through `stream` on the same pool and count toward that limit.
+
+Job state is kept as a small JSON file per job in `state_dir`, so a poll
+can be answered by any gunicorn worker, not only the one that took the
+upload. Pool processes are started from a forkserver: forking a web
+worker that already runs I/O, mail and outbox threads could copy a lock
+held by one of them into the child. A pool broken by a dead process
+(e.g. OOM-killed) is replaced on the next submit.
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from imaging import atomic_write
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _write_state(path, state):
+    with atomic_write(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+
+
+def _run_job(path, state, func, args):
+    # Runs in the pool process
+    _write_state(path, {**state, 'status': 'running'})
+    return func(*args)
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_pending=16, ttl=3600, state_dir='jobs'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self._executor = None
+        self._pid = None
+        self._pool_lock = threading.Lock()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._pruned_at = 0
+
+    def _pool(self):
+        # Created lazily (and again after a fork) so each gunicorn worker has its own pool
+        with self._pool_lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _submit(self, func, *args):
+        executor = self._pool()
+        try:
+            return executor.submit(func, *args)
+        except BrokenProcessPool:
+            # A pool process died and the executor refuses all new work; start a fresh one
+            print("Job pool error: process pool broken, restarting it")
+            with self._pool_lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            return self._pool().submit(func, *args)
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _prune(self):
+        now = time.time()
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        for entry in os.scandir(self.state_dir):
+            try:
+                if entry.name.endswith('.json') and entry.stat().st_mtime < now - self.ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def pending(self):
+        """Unfinished jobs and batch tasks submitted by this process."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def _forget(self, future):
+        with self._lock:
+            self._in_flight.discard(future)
+
+    def submit(self, func, *args, owner=None, callback=None):
+        """Queue func(*args); callback(result) runs in this process if it succeeds.
+
+        Every submission gets its own job id, so two users uploading the
+        same image each own a separate job.
+        """
+        with self._lock:
+            pending = len(self._in_flight)
+            if pending >= self.max_pending:
+                raise QueueFull(f'{pending} jobs already pending')
+            self._prune()
+            job_id = uuid.uuid4().hex
+            path = self._path(job_id)
+            state = {'status': 'queued', 'owner': owner, 'created_at': time.time()}
+            _write_state(path, state)
+            future = self._submit(_run_job, path, state, func, args)
+            self._in_flight.add(future)
+
+        def finished(future):
+            self._forget(future)
+            if future.cancelled():
+                _write_state(path, {**state, 'status': 'failed', 'error': 'Job was cancelled.'})
+            elif future.exception() is not None:
+                _write_state(path, {**state, 'status': 'failed', 'error': str(future.exception())})
+            else:
+                _write_state(path, {**state, 'status': 'done', 'result': future.result()})
+                if callback is not None:
+                    callback(future.result())
+        future.add_done_callback(finished)
+        return job_id
+
+    def stream(self, func, items):
+        """Run func(*args) for each (key, args) in items on the pool.
+
+        Yields (key, result, error) in completion order. At most two tasks
+        per worker are in flight, so inputs are pulled from `items` lazily.
+        Tasks count toward `max_pending`, so busy batches make submit answer
+        QueueFull rather than queue jobs behind them; while the queue is full
+        the stream keeps a single task in flight.
+        """
+        window = self.max_workers * 2
+        in_flight = {}
+
+        def finished(done):
+            for future in done:
+                key = in_flight.pop(future)
+                error = future.exception()
+                yield key, (None if error else future.result()), (str(error) if error else None)
+
+        for key, args in items:
+            while in_flight and (len(in_flight) >= window or self.pending() >= self.max_pending):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+            with self._lock:
+                future = self._submit(func, *args)
+                self._in_flight.add(future)
+            future.add_done_callback(self._forget)
+            in_flight[future] = key
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+
+    def get(self, job_id):
+        """Return a status dict for the job, or None if it is unknown."""
+        if not JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['status'] in ('queued', 'running') and time.time() - state['created_at'] > self.ttl:
+            # The worker process that owned the job is gone
+            state.update(status='failed', error='Job was lost. Please upload the image again.')
+        return {'job_id': job_id, **state}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,116 @@
+"""
+Background sender for Flask-Mail messages.
+
+Routes call `mail_queue.send(msg)`, which only enqueues. One daemon thread
+per process delivers the queue over a single authenticated SMTP
+connection that stays open while mail keeps arriving and is closed after
+`idle_timeout` seconds without any. Transient failures (dropped
+connections, 4xx replies, network errors) reconnect and retry with
+exponential backoff; permanent 5xx rejections are logged and dropped.
+
+For local testing point MAIL_SERVER/MAIL_PORT at `python smtp_sink.py`.
+"""
+
+import atexit
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+
+
+class MailQueue:
+    def __init__(self, app, mail, idle_timeout=30, max_attempts=5, max_pending=1000):
+        self.app = app
+        self.mail = mail
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue(max_pending)
+        self._connection = None
+        self._lock = threading.Lock()
+        self._pid = None
+        atexit.register(self.flush, 10)
+
+    def _ensure_worker(self):
+        # Started lazily (and again after a fork) so each gunicorn worker has its own thread
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._connection = None
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, message):
+        """Queue a message; raises queue.Full if the backlog is at its limit."""
+        self._ensure_worker()
+        self._queue.put_nowait(message)
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """Wait until every queued message has been delivered or given up on."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks and self._pid == os.getpid():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            try:
+                self._deliver(message)
+            except Exception as e:
+                print("Mail error:", e)
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = self.mail.connect()
+            connection.__enter__()
+            self._connection = connection
+        return self._connection
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.host.close()
+
+    def _deliver(self, message):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self.app.app_context():
+                    message.send(self._connect())
+                self.sent += 1
+                return
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500:
+                    print("Mail error:", e)
+                    self.failed += 1
+                    return
+                error = e
+            except smtplib.SMTPRecipientsRefused as e:
+                print("Mail error:", e)
+                self.failed += 1
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+            # The connection is in an unknown state after a failure; start a new one
+            self._disconnect()
+            if attempt < self.max_attempts:
+                time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+        print("Mail error:", error)
+        self.failed += 1
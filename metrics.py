@@ -0,0 +1,195 @@
+"""
+Lightweight request instrumentation with Prometheus text exposition.
+
+A request opens a collector with `begin()`; code on the hot path wraps
+its stages in `with stage('decode'):` and adds counters with `add()`.
+Both are no-ops when no collector is active, so imaging functions can be
+instrumented unconditionally. `end()` folds the collector into the
+process-wide registry, which `/metrics` renders.
+
+Metrics are per process; with several gunicorn workers, scrape each
+worker or aggregate in Prometheus.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PIXEL_BUCKETS = (250_000, 1_000_000, 2_000_000, 4_000_000, 6_250_000, 12_000_000, 24_000_000, 48_000_000, 80_000_000)
+
+_current = ContextVar('metrics_collector', default=None)
+
+
+class Collector:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.counts = {}
+        self.labels = {}
+
+
+def begin():
+    collector = Collector()
+    _current.set(collector)
+    return collector
+
+
+def end():
+    collector = _current.get()
+    _current.set(None)
+    return collector
+
+
+def annotate(**labels):
+    collector = _current.get()
+    if collector is not None:
+        collector.labels.update(labels)
+
+
+def current_labels():
+    collector = _current.get()
+    return dict(collector.labels) if collector is not None else {}
+
+
+def add(name, value):
+    collector = _current.get()
+    if collector is not None:
+        collector.counts[name] = collector.counts.get(name, 0) + value
+
+
+@contextmanager
+def stage(name):
+    collector = _current.get()
+    if collector is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.stages.append((name, time.perf_counter() - start))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+
+class Registry:
+    def __init__(self, prefix='nirvana'):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._callbacks = []
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def observe(self, name, labels, value, buckets=STAGE_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, text, func):
+        """Register a callback evaluated at scrape time; it returns a number."""
+        self.describe(name, 'gauge', text)
+        self._callbacks.append((name, func))
+
+    def counter(self, name, text, func):
+        """Like gauge, for a running total kept elsewhere (it must never decrease)."""
+        self.describe(name, 'counter', text)
+        self._callbacks.append((name, func))
+
+    def record(self, collector, endpoint, status):
+        """Fold a finished request's collector into the registry."""
+        base = {'endpoint': endpoint or 'unknown', **collector.labels}
+        self.observe('request_seconds', {**base, 'status': status}, time.perf_counter() - collector.started)
+        for name, seconds in collector.stages:
+            self.observe('stage_seconds', {**base, 'stage': name}, seconds)
+        for name, value in collector.counts.items():
+            if name == 'pixels':
+                self.observe('image_pixels', base, value, PIXEL_BUCKETS)
+            else:
+                self.inc(name + '_total', base, value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        def header(name, default_kind):
+            kind, text = self._help.get(name, (default_kind, name.replace('_', ' ')))
+            lines.append(f'# HELP {self.prefix}_{name} {text}')
+            lines.append(f'# TYPE {self.prefix}_{name} {kind}')
+
+        last = None
+        for (name, labels), histogram in histograms:
+            if name != last:
+                header(name, 'histogram')
+                last = name
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{self.prefix}_{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+            lines.append(f'{self.prefix}_{name}_sum{{{_labels(labels)}}} {histogram.sum:.6f}')
+            lines.append(f'{self.prefix}_{name}_count{{{_labels(labels)}}} {histogram.count}')
+
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                header(name, 'counter')
+                last = name
+            lines.append(f'{self.prefix}_{name}{{{_labels(labels)}}} {value}')
+
+        for name, func in self._callbacks:
+            header(name, 'gauge')
+            lines.append(f'{self.prefix}_{name} {func()}')
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(collector):
+    """Format a collector's stages as a Server-Timing header value."""
+    totals = {}
+    for name, seconds in collector.stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f'{name.replace(":", "-")};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+    parts.append(f'total;dur={(time.perf_counter() - collector.started) * 1000:.1f}')
+    return ', '.join(parts)
+
+
+registry = Registry()
+registry.describe('request_seconds', 'histogram', 'Request latency by endpoint and status')
+registry.describe('stage_seconds', 'histogram', 'Latency of each processing stage')
+registry.describe('image_pixels', 'histogram', 'Pixels in each decoded source image')
+registry.describe('bytes_read_total', 'counter', 'Encoded image bytes read from disk')
+registry.describe('bytes_written_total', 'counter', 'Encoded image bytes written to disk')
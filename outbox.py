@@ -0,0 +1,160 @@
+"""
+In-process outbox for SNS notifications and admin log writes.
+
+Routes only append to the outbox; a background thread flushes it every
+`flush_interval` seconds. SNS messages go out through `publish_batch`
+(10 per call) and log items through the table's `batch_writer` (25 per
+call). Failed sends are retried with exponential backoff and jitter and
+dropped after `max_attempts`.
+
+Messages published with a `coalesce` key (login notifications) are rate
+limited: at most one SNS message per key per `coalesce_window`, carrying
+every event collected since the previous one.
+
+The outbox is per process and in memory, so anything still queued when
+a worker is killed is lost; `flush()` runs at interpreter exit.
+"""
+
+import atexit
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+SNS_BATCH = 10
+COALESCED_LINES = 50
+
+
+class Outbox:
+    def __init__(self, sns, topic_arn, logs_table, flush_interval=1.0,
+                 coalesce_window=60, max_attempts=5, max_pending=10000):
+        self.sns = sns
+        self.topic_arn = topic_arn
+        self.logs_table = logs_table
+        self.flush_interval = flush_interval
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._messages = []
+        self._logs = []
+        self._coalesced = {}
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _ensure_worker(self):
+        # Started lazily (and again after a fork) so each gunicorn worker has its own thread
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _append(self, queue, entry):
+        if len(queue) >= self.max_pending:
+            queue.pop(0)
+            self.dropped += 1
+        queue.append(entry)
+
+    def publish(self, subject, message, coalesce=None):
+        with self._lock:
+            if coalesce is None:
+                self._append(self._messages, {'subject': subject, 'message': message, 'attempts': 0, 'not_before': 0})
+            else:
+                pending = self._coalesced.setdefault(coalesce, {'subject': subject, 'lines': [], 'count': 0})
+                pending['count'] += 1
+                if len(pending['lines']) < COALESCED_LINES:
+                    pending['lines'].append(message)
+            self._ensure_worker()
+
+    def log(self, item):
+        with self._lock:
+            self._append(self._logs, {'item': item, 'attempts': 0, 'not_before': 0})
+            self._ensure_worker()
+
+    def pending(self):
+        with self._lock:
+            return len(self._messages) + len(self._logs) + sum(p['count'] for p in self._coalesced.values())
+
+    def flush(self):
+        """Send everything queued now, ignoring coalesce windows and backoff."""
+        self._drain(force=True)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._drain()
+            except Exception as e:
+                print("Outbox error:", e)
+
+    def _take_due(self, queue, now, force):
+        due = [entry for entry in queue if force or entry['not_before'] <= now]
+        queue[:] = [entry for entry in queue if not (force or entry['not_before'] <= now)]
+        return due
+
+    def _drain(self, force=False):
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                for key in list(self._coalesced):
+                    if force or now - self._last_sent.get(key, float('-inf')) >= self.coalesce_window:
+                        pending = self._coalesced.pop(key)
+                        self._last_sent[key] = now
+                        self._messages.append(self._coalesced_message(pending))
+                messages = self._take_due(self._messages, now, force)
+                logs = self._take_due(self._logs, now, force)
+
+            for start in range(0, len(messages), SNS_BATCH):
+                self._publish_batch(messages[start:start + SNS_BATCH])
+            if logs:
+                self._write_logs(logs)
+
+    def _coalesced_message(self, pending):
+        if pending['count'] == 1:
+            subject, message = pending['subject'], pending['lines'][0]
+        else:
+            subject = f"{pending['subject']} ({pending['count']})"
+            message = '\n'.join(pending['lines'])
+            if pending['count'] > len(pending['lines']):
+                message += f"\n... and {pending['count'] - len(pending['lines'])} more"
+        return {'subject': subject, 'message': message, 'attempts': 0, 'not_before': 0}
+
+    def _publish_batch(self, batch):
+        entries = [{'Id': str(i), 'Subject': entry['subject'], 'Message': entry['message']}
+                   for i, entry in enumerate(batch)]
+        try:
+            response = self.sns.publish_batch(TopicArn=self.topic_arn, PublishBatchRequestEntries=entries)
+        except (BotoCoreError, ClientError) as e:
+            print("SNS Error:", e)
+            self._retry(self._messages, batch)
+            return
+        failed = response.get('Failed', [])
+        if failed:
+            print("SNS Error:", failed[0].get('Message'))
+            self._retry(self._messages, [batch[int(f['Id'])] for f in failed if not f.get('SenderFault')])
+
+    def _write_logs(self, logs):
+        try:
+            # batch_writer chunks into BatchWriteItem calls and resends unprocessed items
+            with self.logs_table.batch_writer() as writer:
+                for entry in logs:
+                    writer.put_item(Item=entry['item'])
+        except (BotoCoreError, ClientError) as e:
+            print("Admin log error:", e)
+            self._retry(self._logs, logs)
+
+    def _retry(self, queue, entries):
+        now = time.monotonic()
+        with self._lock:
+            for entry in entries:
+                entry['attempts'] += 1
+                if entry['attempts'] >= self.max_attempts:
+                    self.dropped += 1
+                    continue
+                entry['not_before'] = now + min(60, 2 ** entry['attempts']) * random.uniform(0.5, 1.0)
+                self._append(queue, entry)
+
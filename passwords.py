@@ -0,0 +1,121 @@
+"""
+Password hashing off the request hot path, plus per-IP throttling.
+
+bcrypt is deliberately CPU-expensive, so under a login burst it competes
+with the image workers. `PasswordHasher` runs every hash and check in a
+small thread pool (bcrypt releases the GIL while hashing); at most
+`workers` hashes run at once and at most `max_waiting` more may queue.
+Beyond that it raises HasherBusy rather than piling up request threads.
+
+`LoginThrottle` counts attempts per client IP in a sliding window and is
+checked before any hashing, so a flood from one address costs nothing.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import wraps
+
+from flask import flash, make_response, render_template, request
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, bcrypt, rounds=12, workers=2, max_waiting=32, timeout=10):
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_waiting)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Threads do not survive a fork; each gunicorn worker builds its own pool
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._pool().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(self.bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check(self, pw_hash, password):
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True if the hash was made with a different work factor than the current one."""
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+
+class LoginThrottle:
+    def __init__(self, max_attempts=10, window=60, max_clients=100_000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_clients = max_clients
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, client):
+        """Record an attempt; returns seconds to wait if over the limit, else 0."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(client)
+            if attempts is None:
+                attempts = self._attempts[client] = deque()
+                if len(self._attempts) > self.max_clients:
+                    self._attempts.popitem(last=False)
+            self._attempts.move_to_end(client)
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                return int(attempts[0] + self.window - now) + 1
+            attempts.append(now)
+            return 0
+
+
+def throttled(throttle, template, retry_after=5):
+    """Rate limit POSTs to an auth view per IP and answer 503 when hashing is saturated."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'POST':
+                wait = throttle.hit(request.remote_addr)
+                if wait:
+                    flash('Too many attempts. Please wait a moment and try again.', 'danger')
+                    response = make_response(render_template(template), 429)
+                    response.headers['Retry-After'] = str(wait)
+                    return response
+            try:
+                return view(*args, **kwargs)
+            except HasherBusy:
+                flash('The server is busy. Please try again in a few seconds.', 'warning')
+                response = make_response(render_template(template), 503)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+        return wrapper
+    return decorator
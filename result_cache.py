@@ -0,0 +1,106 @@
+"""
+Content-addressed cache of processed results.
+
+Entries are keyed by the hash of the source bytes plus the operation and
+its parameters, and map to the name of the file already written to the
+processed folder. Eviction is LRU, bounded by entry count and age.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ResultCache:
+    def __init__(self, max_entries=512, max_age=3600):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # (path, mtime, size) -> digest, so unchanged sources are hashed once
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def source_digest(self, path):
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(stamp)
+            if digest:
+                self._digests.move_to_end(stamp)
+                return digest
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[stamp] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+    @staticmethod
+    def make_key(digest, operation, params=None):
+        return f"{digest}:{operation}:{json.dumps(params or {}, sort_keys=True)}"
+
+    def get(self, key, folder):
+        """Return the cached output filename, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                output_filename, stored_at, mtime_ns = entry
+                fresh = time.time() - stored_at <= self.max_age
+                # The output must still be the file this entry wrote
+                if fresh and _mtime_ns(os.path.join(folder, output_filename)) == mtime_ns:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return output_filename
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, output_filename, folder):
+        mtime_ns = _mtime_ns(os.path.join(folder, output_filename))
+        if mtime_ns is None:
+            return
+        with self._lock:
+            self._entries[key] = (output_filename, time.time(), mtime_ns)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Minimal local SMTP server that accepts every message and keeps it in memory.
+
+Use it to exercise the mail queue without a real mail server:
+
+    python smtp_sink.py --port 1025
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0 python app.py
+
+or from Python:
+
+    with SMTPSink() as sink:
+        app.config['MAIL_PORT'] = sink.port
+        ...
+        sink.messages  # [{'from': ..., 'to': [...], 'data': b'...'}]
+
+It speaks just enough SMTP for smtplib: EHLO/HELO, AUTH PLAIN (any
+credentials), MAIL, RCPT, DATA, RSET, NOOP and QUIT. No STARTTLS.
+"""
+
+import argparse
+import socketserver
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 smtp-sink ready')
+        envelope = {'from': None, 'to': []}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-smtp-sink')
+                self.reply('250-AUTH PLAIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 smtp-sink')
+            elif verb == 'AUTH':
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                envelope = {'from': command[10:].strip('<> '), 'to': []}
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                envelope['to'].append(command[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                self.server.deliver({**envelope, 'data': b''.join(lines)})
+                envelope = {'from': None, 'to': []}
+                self.reply('250 OK: queued')
+            elif verb == 'RSET':
+                envelope = {'from': None, 'to': []}
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, on_message=None):
+        super().__init__((host, port), _Handler)
+        self.messages = []
+        self.on_message = on_message
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def deliver(self, message):
+        with self._lock:
+            self.messages.append(message)
+        if self.on_message:
+            self.on_message(message)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink that prints every message it receives.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    def show(message):
+        print(f"--- from {message['from']} to {', '.join(message['to'])}")
+        print(message['data'].decode(errors='replace'))
+
+    with SMTPSink(args.host, args.port, on_message=show) as sink:
+        print(f"SMTP sink listening on {args.host}:{sink.port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Where uploads and processed images live.
+
+Files are addressed by area ('uploads' or 'processed') and name. Image
+code always works on local paths, so every backend keeps a local copy:
+
+- LocalStorage: the static folders are the store itself (single node).
+- S3Storage: an S3-compatible bucket is the store and the static folders
+  are a per-node cache. Uploads are written through before the request
+  returns; processed outputs are pushed in the background once they are
+  on disk. Missing local copies are fetched on demand, so any node can
+  serve any image, and `trim_cache` evicts the least recently used local
+  copies to keep each node's cache bounded. Large files move with
+  multipart transfers, and browsers can upload and download directly
+  with presigned URLs.
+
+Set S3_ENDPOINT_URL to MinIO or another S3-compatible server, or to a
+file:// directory to use the local stand-in in fake_s3.py.
+"""
+
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+
+import imaging
+
+# Seconds a new local copy is kept before trim_cache may evict it
+CACHE_GRACE = 600
+
+
+class LocalStorage:
+    remote = False
+
+    def __init__(self, folders):
+        self.folders = folders
+
+    def path(self, area, name):
+        return os.path.join(self.folders[area], name)
+
+    def put_bytes(self, area, name, data):
+        """Store bytes; the local write completes in the background."""
+        imaging.persist_bytes(self.path(area, name), data)
+
+    def save(self, area, name):
+        """Publish a file already written to its local path."""
+
+    def fetch(self, area, name):
+        """Local path of the file, or None if it does not exist."""
+        path = self.path(area, name)
+        return path if os.path.isfile(path) else None
+
+    def exists(self, area, name):
+        return os.path.isfile(self.path(area, name))
+
+    def stored(self, area, name):
+        """True if the store itself (not just this node's cache) holds the file."""
+        return self.exists(area, name)
+
+    def delete(self, area, name):
+        try:
+            os.remove(self.path(area, name))
+        except FileNotFoundError:
+            pass
+
+    def touch(self, area, name):
+        """Mark a local copy as recently used."""
+
+    def evict(self, area, name):
+        """Drop this node's cached copy; the folders are the store here, so keep it."""
+
+    def trim_cache(self, max_bytes):
+        """Evict least recently used local copies; returns bytes freed."""
+        return 0
+
+    def list(self, area):
+        """Yield (name, size, mtime) for every stored file."""
+        for entry in os.scandir(self.folders[area]):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                yield entry.name, stat.st_size, stat.st_mtime
+
+    def download_url(self, area, name, as_attachment=False):
+        """A URL the browser can fetch directly, or None to serve it from Flask."""
+        return None
+
+    def upload_form(self, name, max_bytes):
+        """Fields for a direct browser upload, or None if uploads go through Flask."""
+        return None
+
+
+class S3Storage(LocalStorage):
+    remote = True
+
+    def __init__(self, folders, bucket, client, prefix='', expires=3600,
+                 part_size=8 * 1024 * 1024, upload_workers=4):
+        super().__init__(folders)
+        self.bucket = bucket
+        self.client = client
+        self.prefix = prefix
+        self.expires = expires
+        # Files above part_size are sent and fetched as concurrent multipart transfers
+        self.transfer = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                       max_concurrency=4)
+        self._uploads = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='s3-upload')
+        # Local paths still being uploaded; their copy is the only one, so never evict them
+        self._uploading = set()
+        self._uploading_lock = threading.Lock()
+
+    def key(self, area, name):
+        return f'{self.prefix}{area}/{name}'
+
+    def put_bytes(self, area, name, data):
+        # Written through so the next request can find it on any node
+        imaging.persist_bytes(self.path(area, name), data)
+        self.client.upload_fileobj(io.BytesIO(data), self.bucket, self.key(area, name), Config=self.transfer)
+
+    def save(self, area, name):
+        path = self.path(area, name)
+        with self._uploading_lock:
+            self._uploading.add(path)
+
+        def upload():
+            try:
+                self.client.upload_file(path, self.bucket, self.key(area, name), Config=self.transfer)
+            except (BotoCoreError, ClientError) as e:
+                print("Storage upload error:", e)
+            finally:
+                with self._uploading_lock:
+                    self._uploading.discard(path)
+        return self._uploads.submit(upload)
+
+    def fetch(self, area, name):
+        path = self.path(area, name)
+        if os.path.isfile(path):
+            self.touch(area, name)
+            return path
+        try:
+            with imaging.atomic_write(path) as tmp_path:
+                self.client.download_file(self.bucket, self.key(area, name), tmp_path, Config=self.transfer)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                print("Storage fetch error:", e)
+            return None
+        except BotoCoreError as e:
+            # Endpoint unreachable, timeouts and the like: treat as a miss rather than fail the request
+            print("Storage fetch error:", e)
+            return None
+        return path
+
+    def exists(self, area, name):
+        return os.path.isfile(self.path(area, name)) or self.stored(area, name)
+
+    def stored(self, area, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(area, name))
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, area, name):
+        super().delete(area, name)
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(area, name))
+        except (BotoCoreError, ClientError) as e:
+            print("Storage delete error:", e)
+
+    def touch(self, area, name):
+        # atime only: mtime keys the image and digest caches
+        try:
+            stat = os.stat(self.path(area, name))
+            os.utime(self.path(area, name), ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    def evict(self, area, name):
+        LocalStorage.delete(self, area, name)
+
+    def trim_cache(self, max_bytes):
+        cached = []
+        for area, folder in self.folders.items():
+            for entry in os.scandir(folder):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    cached.append((max(stat.st_atime, stat.st_mtime), stat.st_size, area, entry.name))
+        total = sum(size for _, size, _, _ in cached)
+        freed = 0
+        # New files may not have been handed to save() yet (e.g. /create job outputs)
+        recent = time.time() - CACHE_GRACE
+        for used, size, area, name in sorted(cached):
+            if total <= max_bytes or used > recent:
+                break
+            path = self.path(area, name)
+            with self._uploading_lock:
+                uploading = path in self._uploading
+            if uploading or imaging.is_pending(path):
+                continue
+            self.evict(area, name)
+            total -= size
+            freed += size
+        return freed
+
+    def list(self, area):
+        prefix = self.key(area, '')
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(prefix):], obj['Size'], obj['LastModified'].timestamp()
+
+    def download_url(self, area, name, as_attachment=False):
+        params = {'Bucket': self.bucket, 'Key': self.key(area, name)}
+        if as_attachment:
+            params['ResponseContentDisposition'] = f'attachment; filename="{name}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.expires)
+
+    def upload_form(self, name, max_bytes):
+        # A fresh prefix keeps direct uploads from overwriting each other
+        stored_name = f'{uuid.uuid4().hex[:12]}_{name}'
+        form = self.client.generate_presigned_post(
+            self.bucket, self.key('uploads', stored_name),
+            Conditions=[['content-length-range', 1, max_bytes]],
+            ExpiresIn=self.expires
+        )
+        return {'filename': stored_name, 'url': form['url'], 'fields': form['fields']}
+
+
+def from_config(config):
+    """Build the backend named by STORAGE_BACKEND ('local' or 's3')."""
+    folders = {'uploads': config['UPLOAD_FOLDER'], 'processed': config['PROCESSED_FOLDER']}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+    if config.get('STORAGE_BACKEND', 'local') != 's3':
+        return LocalStorage(folders)
+
+    endpoint = config.get('S3_ENDPOINT_URL')
+    if endpoint and endpoint.startswith('file://'):
+        from fake_s3 import FakeS3Client
+        client = FakeS3Client(endpoint[len('file://'):])
+    else:
+        import boto3
+        client = boto3.client('s3', region_name=config.get('S3_REGION'), endpoint_url=endpoint)
+    return S3Storage(folders, config['S3_BUCKET'], client, config.get('S3_PREFIX', ''),
+                     config.get('PRESIGN_EXPIRY', 3600))
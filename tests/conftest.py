@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+
+import cv2
+import pytest
+
+# The app's modules live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Point the app at throwaway folders and a throwaway database before anything imports it
+TMP = tempfile.mkdtemp(prefix='nirvana-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TMP, 'test.db')}",
+    'UPLOAD_FOLDER': os.path.join(TMP, 'uploads'),
+    'PROCESSED_FOLDER': os.path.join(TMP, 'processed'),
+    'JOB_STATE_FOLDER': os.path.join(TMP, 'jobs'),
+    'GC_LOCK_FILE': os.path.join(TMP, 'artifact-gc.lock'),
+    'ARTIFACT_GC_INTERVAL': '0',
+    'BCRYPT_LOG_ROUNDS': '4',
+    'ASYNC_ENCODE': '0',
+})
+
+PASSWORD = 'correct horse'
+USERS = {1: False, 2: False, 3: True}  # id: is_admin
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    with app_module.app.app_context():
+        app_module.db.create_all()
+        for user_id, is_admin in USERS.items():
+            app_module.db.session.add(app_module.User(
+                id=user_id, username=f'user{user_id}', email=f'user{user_id}@example.com',
+                password=app_module.passwords.hash(PASSWORD), is_admin=is_admin))
+        app_module.db.session.commit()
+    yield app_module
+    app_module.job_queue.shutdown()
+
+
+@pytest.fixture
+def login(app_module):
+    """login(user_id) -> a test client signed in as that user."""
+    def make(user_id=1):
+        client = app_module.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        return client
+    return make
+
+
+@pytest.fixture
+def client(login):
+    return login(1)
+
+
+@pytest.fixture
+def upload(app_module):
+    """upload(name, width, height, seed) -> name of a synthetic JPEG in the upload folder."""
+    from benchmark import synthetic_image
+
+    def make(name, width=320, height=240, seed=0):
+        cv2.imwrite(app_module.store.path('uploads', name), synthetic_image(width, height, seed))
+        return name
+    return make
@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+
+import imaging
+
+
+def shapes():
+    img = np.zeros((240, 320, 3), np.uint8)
+    cv2.rectangle(img, (20, 20), (120, 100), (255, 255, 255), -1)
+    cv2.circle(img, (230, 160), 50, (200, 200, 200), -1)
+    return img
+
+
+def test_objects_are_reported_largest_first():
+    result = imaging.analyze_objects(shapes())
+    assert (result['width'], result['height']) == (320, 240)
+    boxes = [o['bbox'] for o in result['objects']]
+    assert len(boxes) >= 2
+    assert boxes == sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)
+    assert all(len(o['polygon']) >= 3 for o in result['objects'])
+
+
+def test_analysis_mode_returns_json_and_is_cached(app_module, client):
+    cv2.imwrite(app_module.store.path('uploads', 'shapes.png'), shapes())
+    body = {'filename': 'shapes.png', 'operation': 'detect_objects', 'mode': 'analysis'}
+    first = client.post('/process_advanced', json=body)
+    assert first.status_code == 200
+    assert first.get_json()['operation'] == 'detect_objects' and first.get_json()['objects']
+
+    hits = app_module.analysis_cache.hits
+    assert client.post('/process_advanced', json=body).get_json() == first.get_json()
+    assert app_module.analysis_cache.hits == hits + 1
+
+
+def test_analysis_mode_rejects_image_operations(client):
+    body = {'filename': 'shapes.png', 'operation': 'sketch', 'mode': 'analysis'}
+    assert client.post('/process_advanced', json=body).status_code == 400
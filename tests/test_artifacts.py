@@ -0,0 +1,85 @@
+import fcntl
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def empty_store(app_module):
+    """The app with no artifacts, rows or files."""
+    with app_module.app.app_context():
+        for name, _, _ in list(app_module.store.list('processed')):
+            app_module.store.delete('processed', name)
+        app_module.Artifact.query.delete()
+        app_module.db.session.commit()
+    app_module.result_cache.clear()
+    return app_module
+
+
+def add_artifact(app_module, name, size, age_hours):
+    with open(app_module.store.path('processed', name), 'wb') as f:
+        f.write(b'x' * size)
+    when = datetime.utcnow() - timedelta(hours=age_hours)
+    app_module.db.session.add(app_module.Artifact(
+        filename=name, source='src.jpg', operations='[]', owner_id=1, created_at=when, accessed_at=when))
+    app_module.db.session.commit()
+
+
+def names(app_module):
+    with app_module.app.app_context():
+        return sorted(a.filename for a in app_module.Artifact.query)
+
+
+def test_identical_results_share_one_artifact(empty_store, login, upload):
+    name = upload('dedupe.jpg')
+    results = [login(user_id).post('/process_artisan', json={'filename': name, 'operation': 'edges'}).get_json()
+               for user_id in (1, 2)]
+    assert results[0]['filename'] == results[1]['filename']
+    assert names(empty_store) == [results[0]['filename']]
+    assert [n for n, _, _ in empty_store.store.list('processed')] == [results[0]['filename']]
+
+
+def test_gc_evicts_least_recently_used_in_batches(empty_store, monkeypatch):
+    app_module = empty_store
+    monkeypatch.setitem(app_module.app.config, 'GC_BATCH_SIZE', 2)
+    monkeypatch.setitem(app_module.app.config, 'PROCESSED_QUOTA_BYTES', 250)
+    with app_module.app.app_context():
+        for i, age in enumerate([5, 1, 4, 2, 3]):
+            add_artifact(app_module, f'{i}.png', 100, age)
+        # A row whose file never landed, old enough to be past the write grace period
+        app_module.db.session.add(app_module.Artifact(
+            filename='lost.png', source='src.jpg', operations='[]',
+            created_at=datetime.utcnow() - timedelta(hours=1)))
+        app_module.db.session.commit()
+        stats = app_module.run_gc()
+
+    assert stats['missing'] == 1
+    assert stats['deleted'] == 3 and stats['freed_bytes'] == 300
+    assert stats['remaining_bytes'] == 200
+    # Ages 5, 4 and 3 hours were evicted first
+    assert names(app_module) == ['1.png', '3.png']
+    assert not os.path.exists(app_module.store.path('processed', '0.png'))
+
+
+def test_gc_runs_once_per_interval_and_not_concurrently(empty_store):
+    app_module = empty_store
+    with app_module.app.app_context():
+        assert app_module.run_gc() is not None
+        assert app_module.run_gc(min_interval=3600) is None
+
+        with open(app_module.app.config['GC_LOCK_FILE'], 'a') as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            assert app_module.run_gc() is None
+            fcntl.flock(held, fcntl.LOCK_UN)
+
+
+def test_admin_gc_route(empty_store, login):
+    app_module = empty_store
+    assert login(1).post('/admin/gc').status_code == 403
+    assert login(3).post('/admin/gc').get_json()['deleted'] == 0
+
+    with open(app_module.app.config['GC_LOCK_FILE'], 'a') as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        assert login(3).post('/admin/gc').status_code == 409
+        fcntl.flock(held, fcntl.LOCK_UN)
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+os.environ['DYNAMODB_ENDPOINT_URL'] = 'memory://'
+
+PASSWORD = 'correct horse'
+
+
+@pytest.fixture(scope='module')
+def aws():
+    import app_aws
+    app_aws.app.config['TESTING'] = True
+    app_aws.users_table.put_item(Item={
+        'email': 'admin@example.com', 'kind': 'user', 'username': 'admin',
+        'password': app_aws.passwords.hash(PASSWORD), 'is_admin': True})
+    return app_aws
+
+
+@pytest.fixture(autouse=True)
+def quiet(aws, monkeypatch):
+    # Nothing is published to SNS from tests
+    monkeypatch.setattr(aws, 'send_sns', lambda *args, **kwargs: None)
+    monkeypatch.setattr(aws, 'log_admin_action', lambda message: None)
+    aws.user_cache.clear()
+
+
+def sign_up(aws, email):
+    client = aws.app.test_client()
+    response = client.post('/signup', data={'email': email, 'username': email.split('@')[0], 'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+def log_in(aws, email):
+    client = aws.app.test_client()
+    assert client.post('/login', data={'email': email, 'password': PASSWORD}).status_code == 302
+    return client
+
+
+def test_memory_endpoint_selects_the_stand_in(aws):
+    from fake_dynamodb import FakeDynamoDB, FakeTable
+    assert isinstance(aws.dynamodb, FakeDynamoDB)
+    assert isinstance(aws.users_table, FakeTable)
+
+
+def test_signup_and_login_round_trip(aws):
+    sign_up(aws, 'roundtrip@example.com')
+    item = aws.users_table.get_item(Key={'email': 'roundtrip@example.com'})['Item']
+    assert item['kind'] == 'user' and not item['is_admin']
+    client = log_in(aws, 'roundtrip@example.com')
+    assert client.get('/home').status_code == 200
+    with aws.app.test_request_context():
+        assert aws.load_user('missing@example.com') is None
+
+
+def test_snapshot_leaves_admin_rights_out(aws, monkeypatch):
+    monkeypatch.setitem(aws.app.config, 'USER_SESSION_SNAPSHOT', True)
+    sign_up(aws, 'promoted@example.com')
+    user = log_in(aws, 'promoted@example.com')
+    with user.session_transaction() as session:
+        assert 'is_admin' not in session['user_snapshot']
+    # make_admin sends non-admins home and admins back to the dashboard
+    assert user.post('/make_admin/nobody@example.com').location == '/home'
+
+    assert log_in(aws, 'admin@example.com').post('/make_admin/promoted@example.com').status_code == 302
+    # The promotion is seen on the next request, not when the snapshot expires
+    assert user.post('/make_admin/nobody@example.com').location == '/admin_dashboard'
+
+
+def test_snapshot_serves_requests_without_reading_the_table(aws, monkeypatch):
+    monkeypatch.setitem(aws.app.config, 'USER_SESSION_SNAPSHOT', True)
+    sign_up(aws, 'snapshot@example.com')
+    client = log_in(aws, 'snapshot@example.com')
+    reads = []
+    get_item = aws.users_table.get_item
+    monkeypatch.setattr(aws.users_table, 'get_item', lambda **kwargs: reads.append(kwargs) or get_item(**kwargs))
+    for _ in range(3):
+        assert client.get('/home').status_code == 200
+    # The login cached the item for the admin check in the page header
+    assert reads == []
+
+
+def test_admin_counter_moves_once_per_promotion(aws):
+    runner = aws.app.test_cli_runner()
+    assert runner.invoke(args=['recount-admins']).exception is None
+    before = aws.admin_total()
+    assert before >= 1
+
+    sign_up(aws, 'counted@example.com')
+    admin = log_in(aws, 'admin@example.com')
+    for _ in range(2):
+        assert admin.post('/make_admin/counted@example.com').location == '/admin_dashboard'
+    # Unknown emails are not created as admins
+    admin.post('/make_admin/ghost@example.com')
+    assert aws.users_table.get_item(Key={'email': 'ghost@example.com'}) == {}
+    assert aws.admin_total() == before + 1
+
+    runner.invoke(args=['recount-admins'])
+    assert aws.admin_total() == before + 1
+
+
+def test_user_total_refreshes_describe_table_on_a_ttl(aws, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(aws.users_table, 'reload', lambda: reloads.append(1))
+    aws.table_stats.clear()
+    total = aws.user_total()
+    assert total == aws.users_table.item_count
+    assert aws.user_total() == total
+    assert len(reloads) == 1
+
+    aws.table_stats.clear()
+    aws.user_total()
+    assert len(reloads) == 2
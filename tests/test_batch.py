@@ -0,0 +1,73 @@
+import io
+import json
+import zipfile
+
+import cv2
+import pytest
+
+import batch
+from benchmark import synthetic_image
+
+
+def jpeg(seed=0):
+    return cv2.imencode('.jpg', synthetic_image(96, 64, seed))[1].tobytes()
+
+
+def zip_of(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_zip_uploads_are_expanded_and_names_sanitised():
+    uploads = [('a.jpg', b'1'), ('set.zip', zip_of([('dir/b.jpg', b'2'), ('../../c.jpg', b'3'), ('empty/', b'')]))]
+    assert list(batch.iter_inputs(uploads, 10, 100)) == [('a.jpg', b'1'), ('b.jpg', b'2'), ('c.jpg', b'3')]
+
+
+@pytest.mark.parametrize('uploads, message', [
+    ([('a.jpg', b'1'), ('b.jpg', b'2'), ('c.jpg', b'3')], 'at most 2 images'),
+    ([('set.zip', zip_of([('a.jpg', b'1'), ('b.jpg', b'2'), ('c.jpg', b'3')]))], 'at most 2 images'),
+    ([('set.zip', zip_of([('big.jpg', b'x' * 101)]))], 'larger than the upload limit'),
+    ([('bad.zip', b'not a zip')], 'not a valid ZIP'),
+])
+def test_limits(uploads, message):
+    with pytest.raises(batch.BatchError, match=message):
+        list(batch.iter_inputs(uploads, 2, 100))
+
+
+def test_stream_zip_writes_outputs_and_manifest():
+    results = [('a.png', b'A', None), ('a.png', b'B', None), ('bad.jpg', None, 'Artifact unreadable.')]
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(batch.stream_zip(results))))
+    assert archive.read('a.png') == b'A' and archive.read('a_1.png') == b'B'
+    assert json.loads(archive.read('manifest.json')) == [
+        {'file': 'a.png', 'status': 'done', 'output': 'a.png'},
+        {'file': 'a.png', 'status': 'done', 'output': 'a_1.png'},
+        {'file': 'bad.jpg', 'status': 'failed', 'error': 'Artifact unreadable.'},
+    ]
+
+
+def test_batch_route_streams_a_zip(client):
+    files = [(io.BytesIO(jpeg(1)), 'one.jpg'), (io.BytesIO(zip_of([('two.jpg', jpeg(2))])), 'more.zip'),
+             (io.BytesIO(b'not an image'), 'broken.jpg')]
+    response = client.post('/process_batch', data={'operations': '["bw", "edges"]', 'format': 'png', 'files': files},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    manifest = {entry['file']: entry for entry in json.loads(archive.read('manifest.json'))}
+    assert manifest['one.png']['status'] == 'done' and manifest['two.png']['status'] == 'done'
+    assert manifest['broken.png']['status'] == 'failed'
+    assert archive.read('one.png').startswith(b'\x89PNG')
+
+
+def test_batch_route_enforces_file_limit(app_module, client, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'BATCH_MAX_FILES', 1)
+    files = [(io.BytesIO(jpeg()), 'a.jpg'), (io.BytesIO(jpeg()), 'b.jpg')]
+    response = client.post('/process_batch', data={'operations': 'bw', 'files': files},
+                           content_type='multipart/form-data')
+    # The first image is already streaming when the limit is hit; the manifest reports it
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    manifest = json.loads(archive.read('manifest.json'))
+    assert [entry['status'] for entry in manifest] == ['done', 'failed']
+    assert 'at most 1 images' in manifest[1]['error']
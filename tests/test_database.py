@@ -0,0 +1,22 @@
+from sqlalchemy import text
+
+
+def test_email_has_a_single_unique_index(app_module):
+    with app_module.app.app_context():
+        session = app_module.db.session
+        # (seq, name, unique, origin, partial) per index; (seqno, cid, name) per column
+        email_indexes = [index for index in session.execute(text("PRAGMA index_list('user')"))
+                         if [column[2] for column in session.execute(text(f"PRAGMA index_info('{index[1]}')"))] == ['email']]
+    assert len(email_indexes) == 1
+    assert email_indexes[0][2] == 1
+
+
+def test_sqlite_connections_use_wal(app_module):
+    with app_module.app.app_context():
+        assert app_module.db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+
+
+def test_load_user(app_module):
+    with app_module.app.test_request_context():
+        assert app_module.load_user('1').username == 'user1'
+        assert app_module.load_user('999') is None
@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+import imaging
+from benchmark import synthetic_image
+
+
+def test_tiled_denoise_matches_single_shot():
+    # Odd sizes so the last row and column of tiles are partial
+    img = synthetic_image(700, 530)
+    single = imaging.denoise(img)
+    tiled = imaging.denoise_tiled(img, tile=256, workers=4)
+    assert tiled.shape == single.shape
+    assert np.abs(tiled.astype(np.int16) - single).max() <= 1
+
+
+def test_heritage_passes_worker_cap_to_tiled_denoise(monkeypatch):
+    calls = []
+    monkeypatch.setattr(imaging, 'TILED_DENOISE_MIN_PIXELS', 100)
+    monkeypatch.setattr(imaging, 'denoise_tiled', lambda img, workers=None: calls.append(workers) or img.copy())
+    imaging.heritage(synthetic_image(64, 48), workers=3)
+    assert calls == [3]
+
+
+def test_denoise_workers_split_cores_between_jobs(app_module):
+    config = app_module.app.config
+    assert config['JOB_WORKERS'] * config['DENOISE_WORKERS'] <= (os.cpu_count() or 2)
@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import pytest
+
+import imaging
+from benchmark import synthetic_image
+
+
+def test_async_write_lands_and_runs_callback(tmp_path):
+    path = str(tmp_path / 'out.png')
+    done = []
+    imaging.write_image_async(path, synthetic_image(64, 48), callback=lambda: done.append(True)).result(10)
+    assert done == [True]
+    assert cv2.imread(path).shape == (48, 64, 3)
+    assert not imaging.is_pending(path)
+
+
+def test_async_write_falls_back_to_sync_when_pool_is_busy(tmp_path):
+    # Hold every encode slot, as a burst of slow writes would
+    for _ in range(imaging.WRITE_WORKERS):
+        assert imaging._write_slots.acquire(blocking=False)
+    try:
+        path = str(tmp_path / 'out.jpg')
+        future = imaging.write_image_async(path, synthetic_image(64, 48), quality=80)
+        # Written before returning, without a pending marker
+        assert future.done()
+        assert os.path.exists(path)
+        assert not os.path.exists(imaging._pending_marker(path))
+    finally:
+        for _ in range(imaging.WRITE_WORKERS):
+            imaging._write_slots.release()
+
+
+@pytest.mark.parametrize('options', [
+    {'format': 'gif'},
+    {'quality': 'high'},
+    {'quality': 0},
+    {'quality': 101},
+    {'png_compression': 10},
+    {'png_compression': None},
+])
+def test_invalid_encoding_options_are_rejected(app_module, options):
+    with pytest.raises(ValueError):
+        app_module.encoding_options(options)
+
+
+def test_encoding_options_defaults(app_module):
+    config = app_module.app.config
+    assert app_module.encoding_options({'format': 'source'}) == {
+        'format': None, 'quality': config['OUTPUT_QUALITY'], 'png_compression': config['PNG_COMPRESSION']}
+    assert app_module.encoding_options({'format': 'png', 'png_compression': '9'})['png_compression'] == 9
+
+
+def test_route_answers_400_for_bad_quality(client, upload):
+    name = upload('encoding.jpg')
+    response = client.post('/process_artisan', json={'filename': name, 'operation': 'dilation', 'quality': 'high'})
+    assert response.status_code == 400
+
+
+def test_route_writes_requested_format(client, upload):
+    name = upload('encoding-png.jpg')
+    response = client.post('/process_artisan', json={'filename': name, 'operation': 'dilation', 'format': 'png'})
+    assert response.status_code == 200
+    assert response.get_json()['filename'].endswith('.png')
+    assert client.get(response.get_json()['image_url']).data.startswith(b'\x89PNG')
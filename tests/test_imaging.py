@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance
+
+import imaging
+from benchmark import synthetic_image
+
+
+def pil_color(img, factor):
+    """ImageEnhance.Color on a BGR array, as /create did before the pointwise engine."""
+    rgb = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return cv2.cvtColor(np.asarray(ImageEnhance.Color(rgb).enhance(factor)), cv2.COLOR_RGB2BGR)
+
+
+def test_heritage_colour_matches_pil_within_one_level():
+    rng = np.random.default_rng(1)
+    for img in (synthetic_image(640, 480), rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)):
+        expected = pil_color(img, imaging.HERITAGE_COLOR)
+        actual = imaging.apply_pointwise(img, (('color', imaging.HERITAGE_COLOR),))
+        diff = np.abs(actual.astype(np.int16) - expected)
+        assert diff.max() <= 1
+        assert (diff > 0).mean() < 0.1
+
+
+def test_heritage_colour_in_place_matches_copy():
+    img = synthetic_image(320, 240)
+    expected = imaging.apply_pointwise(img, (('color', imaging.HERITAGE_COLOR),))
+    out = img.copy()
+    assert imaging.apply_pointwise(out, (('color', imaging.HERITAGE_COLOR),), out=out) is out
+    assert np.array_equal(out, expected)
+
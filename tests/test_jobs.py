@@ -0,0 +1,80 @@
+import io
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import pytest
+
+from benchmark import synthetic_image
+from jobs import JobQueue, QueueFull
+
+
+def wait_for(queue, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(1, 2, state_dir=str(tmp_path))
+    yield queue
+    queue.shutdown()
+
+
+def test_state_is_visible_to_other_workers(queue, tmp_path):
+    job_id = queue.submit(pow, 2, 10, owner='1')
+    other_worker = JobQueue(state_dir=str(tmp_path))
+    assert other_worker.get(job_id)['status'] in ('queued', 'running', 'done')
+    assert wait_for(other_worker, job_id) | {'created_at': 0} == {
+        'job_id': job_id, 'status': 'done', 'result': 1024, 'owner': '1', 'created_at': 0}
+
+
+def test_failed_job_reports_error(queue):
+    job = wait_for(queue, queue.submit(int, 'not a number'))
+    assert job['status'] == 'failed'
+    assert 'invalid literal' in job['error']
+
+
+def test_queue_full_raises(queue):
+    queue.submit(time.sleep, 1)
+    queue.submit(time.sleep, 1)
+    with pytest.raises(QueueFull):
+        queue.submit(time.sleep, 1)
+
+
+def test_broken_pool_is_rebuilt(queue):
+    with pytest.raises(BrokenProcessPool):
+        queue._submit(os._exit, 1).result(timeout=30)
+    assert wait_for(queue, queue.submit(pow, 3, 2))['result'] == 9
+
+
+def test_malformed_job_id_is_unknown(queue):
+    assert queue.get('../../etc/passwd') is None
+    assert queue.get('0' * 32) is None
+
+
+def test_same_upload_by_two_users_gives_each_their_own_job(login):
+    data = cv2.imencode('.jpg', synthetic_image(320, 240, seed=4))[1].tobytes()
+    first, second = login(1), login(2)
+    jobs = []
+    for client in (first, second):
+        response = client.post('/create', data={'file': (io.BytesIO(data), 'same.jpg')},
+                               content_type='multipart/form-data')
+        assert response.status_code in (200, 202)
+        jobs.append(response.get_json().get('job_id'))
+
+    assert jobs[0] and jobs[0] != jobs[1]
+    deadline = time.monotonic() + 30
+    while (status := first.get(f'/jobs/{jobs[0]}').get_json())['status'] not in ('done', 'failed'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert status['status'] == 'done'
+    assert first.get(status['result_url']).status_code == 200
+    # Jobs are private to the user who submitted them
+    assert second.get(f'/jobs/{jobs[0]}').status_code == 404
@@ -0,0 +1,122 @@
+import queue
+import time
+
+import pytest
+from flask import Flask
+from flask_mail import Mail, Message
+
+import mail_queue as mail_queue_module
+from mail_queue import MailQueue
+from smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as sink:
+        yield sink
+
+
+def make_queue(sink, monkeypatch, **kwargs):
+    app = Flask(__name__)
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+                      MAIL_DEFAULT_SENDER='noreply@example.com')
+    mail = Mail(app)
+    mails = MailQueue(app, mail, **kwargs)
+    mails.connections = 0
+    connect = mail.connect
+
+    def counting_connect():
+        mails.connections += 1
+        return connect()
+    monkeypatch.setattr(mail, 'connect', counting_connect)
+    return mails
+
+
+def message(i):
+    return Message(f'Message {i}', sender='noreply@example.com', recipients=[f'user{i}@example.com'], body='Hello')
+
+
+def test_messages_share_one_connection(sink, monkeypatch):
+    mails = make_queue(sink, monkeypatch)
+    for i in range(3):
+        mails.send(message(i))
+    assert mails.flush(10)
+    assert mails.sent == 3 and mails.connections == 1
+    assert [m['to'] for m in sink.messages] == [['user0@example.com'], ['user1@example.com'], ['user2@example.com']]
+
+
+def test_idle_connection_is_closed_and_reopened(sink, monkeypatch):
+    mails = make_queue(sink, monkeypatch, idle_timeout=0.05)
+    mails.send(message(0))
+    assert mails.flush(10)
+    # Wait past the idle timeout so the worker hangs up
+    deadline = time.monotonic() + 10
+    while mails._connection is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mails._connection is None
+    mails.send(message(1))
+    assert mails.flush(10)
+    assert mails.sent == 2 and mails.connections == 2
+
+
+def test_transient_failure_is_retried_with_backoff(sink, monkeypatch):
+    mails = make_queue(sink, monkeypatch)
+    sleeps = []
+    monkeypatch.setattr(mail_queue_module.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(mail_queue_module.random, 'uniform', lambda low, high: high)
+    connect = mails.mail.connect
+    failures = iter([ConnectionRefusedError('refused'), ConnectionResetError('reset')])
+
+    def flaky_connect():
+        error = next(failures, None)
+        if error:
+            raise error
+        return connect()
+    monkeypatch.setattr(mails.mail, 'connect', flaky_connect)
+
+    mails.send(message(0))
+    mails._queue.join()
+    assert mails.sent == 1 and mails.failed == 0
+    assert sleeps == [2, 4]
+    assert len(sink.messages) == 1
+
+
+def test_gives_up_after_max_attempts(monkeypatch, sink):
+    mails = make_queue(sink, monkeypatch, max_attempts=3)
+    sleeps = []
+    monkeypatch.setattr(mail_queue_module.time, 'sleep', sleeps.append)
+
+    def refuse():
+        raise ConnectionRefusedError('refused')
+    monkeypatch.setattr(mails.mail, 'connect', refuse)
+
+    mails.send(message(0))
+    mails._queue.join()
+    assert mails.sent == 0 and mails.failed == 1
+    assert len(sleeps) == 2
+    assert sink.messages == []
+
+
+def test_full_backlog_raises(sink, monkeypatch):
+    mails = make_queue(sink, monkeypatch, max_pending=1)
+    monkeypatch.setattr(mails, '_ensure_worker', lambda: None)
+    mails.send(message(0))
+    with pytest.raises(queue.Full):
+        mails.send(message(1))
+
+
+def test_reset_request_queues_email(app_module, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_module.mail_queue, 'send', sent.append)
+    response = app_module.app.test_client().post('/reset_password', data={'email': 'user1@example.com'})
+    assert response.status_code == 302
+    assert sent[0].recipients == ['user1@example.com']
+
+
+def test_reset_request_with_full_backlog_answers_503(app_module, monkeypatch):
+    def full(message):
+        raise queue.Full
+    monkeypatch.setattr(app_module.mail_queue, 'send', full)
+    response = app_module.app.test_client().post('/reset_password', data={'email': 'user1@example.com'})
+    assert response.status_code == 503
+    assert b'Reset emails are delayed' in response.data
@@ -0,0 +1,37 @@
+import metrics
+
+
+def test_metrics_needs_admin_or_token(app_module, login, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'METRICS_TOKEN', 's3cret')
+    anonymous = app_module.app.test_client()
+    assert anonymous.get('/metrics').status_code == 403
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert login(1).get('/metrics').status_code == 403
+
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+    assert login(3).get('/metrics').status_code == 200
+
+
+def test_metrics_without_token_is_admin_only(app_module, login, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'METRICS_TOKEN', None)
+    assert app_module.app.test_client().get('/metrics', headers={'Authorization': 'Bearer None'}).status_code == 403
+    assert login(3).get('/metrics').status_code == 200
+
+
+def test_result_cache_hits_and_misses_are_counters(login):
+    text = login(3).get('/metrics').get_data(as_text=True)
+    assert '# TYPE nirvana_result_cache_hits_total counter' in text
+    assert '# TYPE nirvana_result_cache_misses_total counter' in text
+    assert '# TYPE nirvana_result_cache_entries gauge' in text
+
+
+def test_request_stages_are_recorded():
+    registry = metrics.Registry(prefix='test')
+    collector = metrics.begin()
+    with metrics.stage('decode'):
+        metrics.add('bytes_read', 10)
+    metrics.end()
+    registry.record(collector, 'process_artisan', 200)
+    text = registry.render()
+    assert 'test_stage_seconds_count{endpoint="process_artisan",stage="decode"} 1' in text
+    assert 'test_bytes_read_total{endpoint="process_artisan"} 10' in text
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+from flask_bcrypt import Bcrypt
+
+from conftest import PASSWORD
+from passwords import HasherBusy, LoginThrottle, PasswordHasher
+
+
+def test_throttle_limits_each_client_within_the_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('passwords.time.monotonic', lambda: now[0])
+    throttle = LoginThrottle(max_attempts=3, window=60)
+    assert [throttle.hit('1.2.3.4') for _ in range(3)] == [0, 0, 0]
+    assert throttle.hit('1.2.3.4') == 61
+    assert throttle.hit('5.6.7.8') == 0
+
+    now[0] += 61
+    assert throttle.hit('1.2.3.4') == 0
+
+
+def test_throttle_tracks_a_bounded_number_of_clients():
+    throttle = LoginThrottle(max_attempts=1, window=60, max_clients=2)
+    for client in ('a', 'b', 'c'):
+        throttle.hit(client)
+    # 'a' was forgotten to make room for 'c'
+    assert throttle.hit('a') == 0
+    assert throttle.hit('c') > 0
+
+
+def test_hasher_round_trip_and_rehash_detection():
+    hasher = PasswordHasher(Bcrypt(), rounds=4)
+    pw_hash = hasher.hash('secret')
+    assert hasher.check(pw_hash, 'secret') and not hasher.check(pw_hash, 'wrong')
+    assert not hasher.needs_rehash(pw_hash)
+    assert PasswordHasher(Bcrypt(), rounds=5).needs_rehash(pw_hash)
+
+
+def test_hasher_refuses_work_beyond_its_queue():
+    release = threading.Event()
+
+    class SlowBcrypt:
+        def generate_password_hash(self, password, rounds):
+            release.wait(10)
+            return b'hash'
+
+    hasher = PasswordHasher(SlowBcrypt(), workers=1, max_waiting=0)
+    worker = threading.Thread(target=hasher.hash, args=('secret',))
+    worker.start()
+    try:
+        # Wait until the first hash holds the only slot
+        deadline = time.monotonic() + 10
+        while hasher._slots._value and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with pytest.raises(HasherBusy):
+            hasher.hash('other')
+    finally:
+        release.set()
+        worker.join()
+
+
+def post_login(app_module, password, addr):
+    return app_module.app.test_client().post('/login', data={'email': 'user2@example.com', 'password': password},
+                                             environ_base={'REMOTE_ADDR': addr})
+
+
+def test_login_is_throttled_per_address(app_module):
+    limit = app_module.app.config['AUTH_RATE_LIMIT']
+    for _ in range(limit):
+        assert post_login(app_module, 'wrong', '10.0.0.1').status_code == 200
+    response = post_login(app_module, PASSWORD, '10.0.0.1')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert post_login(app_module, PASSWORD, '10.0.0.2').status_code == 302
+
+
+def test_login_upgrades_the_work_factor(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.passwords, 'rounds', app_module.passwords.rounds + 1)
+    assert post_login(app_module, PASSWORD, '10.0.0.3').status_code == 302
+    with app_module.app.app_context():
+        pw_hash = app_module.db.session.get(app_module.User, 2).password
+    assert not app_module.passwords.needs_rehash(pw_hash)
+
+
+def test_busy_hasher_answers_503(app_module, monkeypatch):
+    def busy(*args):
+        raise HasherBusy()
+    monkeypatch.setattr(app_module.passwords, 'check', busy)
+    response = post_login(app_module, PASSWORD, '10.0.0.4')
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+
+import imaging
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_preview_is_viewport_sized(client, upload):
+    name = upload('preview-source.jpg', width=1600, height=1200, seed=3)
+    response = client.post('/process_advanced', json={'filename': name, 'operation': 'bw', 'preview': 400})
+    assert response.status_code == 200
+    preview = response.get_json()
+    assert preview['preview'] and preview['filename'].startswith('preview-')
+    img = decode(client.get(preview['image_url']).data)
+    assert max(img.shape[:2]) == imaging.preview_level(400)
+
+
+def test_download_replays_the_chain_at_full_resolution(client, upload):
+    name = upload('preview-chain.jpg', width=1600, height=1200, seed=5)
+    first = client.post('/process_advanced', json={'filename': name, 'operation': 'bw', 'preview': 400}).get_json()
+    second = client.post('/process_artisan', json={
+        'filename': first['filename'], 'operation': 'edges', 'preview': 400, 'format': 'png'}).get_json()
+
+    download = client.get(f"/download/{second['filename']}")
+    assert download.status_code == 200
+    rendered = decode(download.data)
+    assert rendered.shape[:2] == (1200, 1600)
+
+    # Same pixels as running the whole chain with the pipeline endpoint
+    pipeline = client.post('/process_pipeline', json={
+        'filename': name, 'operations': ['bw', 'edges'], 'format': 'png'}).get_json()
+    assert np.array_equal(rendered, decode(client.get(pipeline['image_url']).data))
+
+
+def test_preview_of_collected_lineage_is_404(app_module, client, upload):
+    name = upload('preview-gone.jpg', seed=6)
+    preview = client.post('/process_advanced', json={'filename': name, 'operation': 'bw', 'preview': 256}).get_json()
+    with app_module.app.app_context():
+        app_module.Artifact.query.filter_by(filename=preview['filename']).delete()
+        app_module.db.session.commit()
+    assert client.get(f"/download/{preview['filename']}").status_code == 404
+
+
+def test_preview_size_must_be_a_number(client, upload):
+    name = upload('preview-bad.jpg')
+    response = client.post('/process_artisan', json={'filename': name, 'operation': 'edges', 'preview': 'big'})
+    assert response.status_code == 400
+
+
+def test_upload_named_like_a_preview_is_an_ordinary_source(client, upload):
+    name = upload('preview-holiday.jpg')
+    assert client.post('/process_artisan', json={'filename': name, 'operation': 'edges'}).status_code == 200
+    assert client.post('/process_artisan', json={'filename': name, 'operation': 'edges', 'preview': 256}).status_code == 200
@@ -0,0 +1,81 @@
+import os
+
+from result_cache import ResultCache, file_digest
+
+
+def write(folder, name, data=b'output'):
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(data)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache()
+    write(tmp_path, 'out.png')
+    key = ResultCache.make_key('digest', 'artisan:edges', {'quality': 90})
+    assert cache.get(key, tmp_path) is None
+    cache.put(key, 'out.png', tmp_path)
+    assert cache.get(key, tmp_path) == 'out.png'
+    assert cache.stats() | {'hit_ratio': 0} == {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'hit_ratio': 0}
+
+
+def test_keys_depend_on_params_not_their_order():
+    assert ResultCache.make_key('d', 'op', {'a': 1, 'b': 2}) == ResultCache.make_key('d', 'op', {'b': 2, 'a': 1})
+    assert ResultCache.make_key('d', 'op', {'a': 1}) != ResultCache.make_key('d', 'op', {'a': 2})
+
+
+def test_entry_count_is_bounded_least_recently_used_first(tmp_path):
+    cache = ResultCache(max_entries=2)
+    for name in 'abc':
+        write(tmp_path, name)
+    cache.put('a', 'a', tmp_path)
+    cache.put('b', 'b', tmp_path)
+    assert cache.get('a', tmp_path) == 'a'
+    cache.put('c', 'c', tmp_path)
+    assert cache.get('b', tmp_path) is None
+    assert cache.get('a', tmp_path) == 'a' and cache.get('c', tmp_path) == 'c'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    cache = ResultCache(max_age=60)
+    write(tmp_path, 'out.png')
+    now = 1_000_000.0
+    monkeypatch.setattr('result_cache.time.time', lambda: now)
+    cache.put('key', 'out.png', tmp_path)
+    now += 61
+    assert cache.get('key', tmp_path) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_rewritten_or_deleted_output_is_a_miss(tmp_path):
+    cache = ResultCache()
+    write(tmp_path, 'out.png')
+    cache.put('key', 'out.png', tmp_path)
+    stat = os.stat(tmp_path / 'out.png')
+    os.utime(tmp_path / 'out.png', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.get('key', tmp_path) is None
+
+    cache.put('key', 'out.png', tmp_path)
+    os.remove(tmp_path / 'out.png')
+    assert cache.get('key', tmp_path) is None
+    # Nothing is cached for an output that is not on disk
+    cache.put('key', 'out.png', tmp_path)
+    assert cache.stats()['entries'] == 0
+
+
+def test_source_digest_follows_content(tmp_path):
+    cache = ResultCache()
+    write(tmp_path, 'src.jpg', b'one')
+    path = str(tmp_path / 'src.jpg')
+    assert cache.source_digest(path) == file_digest(path)
+    write(tmp_path, 'src.jpg', b'two!')
+    assert cache.source_digest(path) == file_digest(path)
+
+
+def test_repeat_request_is_served_from_cache(app_module, client, upload):
+    name = upload('cached.jpg')
+    body = {'filename': name, 'operation': 'edges', 'format': 'png'}
+    first = client.post('/process_artisan', json=body).get_json()
+    hits = app_module.result_cache.stats()['hits']
+    assert client.post('/process_artisan', json=body).get_json() == first
+    assert app_module.result_cache.stats()['hits'] == hits + 1
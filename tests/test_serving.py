@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def artifact(client, upload):
+    name = upload('served.jpg', seed=7)
+    return client.post('/process_artisan', json={'filename': name, 'operation': 'edges', 'format': 'png'}).get_json()
+
+
+def test_artifact_is_immutable_with_content_etag(client, artifact):
+    response = client.get(artifact['image_url'])
+    assert response.status_code == 200
+    assert response.headers['ETag'].strip('"')
+    assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+    assert response.cache_control.public
+
+
+def test_matching_etag_is_a_304(client, artifact):
+    etag = client.get(artifact['image_url']).headers['ETag']
+    response = client.get(artifact['image_url'], headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get(artifact['image_url'], headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_range_requests(client, artifact):
+    full = client.get(artifact['image_url']).data
+    response = client.get(artifact['image_url'], headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.data == full[:100]
+    assert response.headers['Content-Range'] == f'bytes 0-99/{len(full)}'
+    assert client.get(artifact['image_url'], headers={'Range': f'bytes={len(full)}-'}).status_code == 416
+
+
+def test_download_is_a_private_attachment(client, artifact):
+    response = client.get(f"/download/{artifact['filename']}")
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].startswith('attachment')
+    assert response.cache_control.private
+
+
+def test_legacy_names_must_revalidate(app_module, client):
+    with open(os.path.join(app_module.app.config['PROCESSED_FOLDER'], 'heritage_old.jpg'), 'wb') as f:
+        f.write(b'legacy')
+    response = client.get('/processed/heritage_old.jpg')
+    assert response.status_code == 200
+    assert response.cache_control.no_cache and response.cache_control.max_age == 0
+
+
+@pytest.mark.parametrize('name', ['missing.png', '..%2Fapp.py'])
+def test_unknown_files_are_404(client, name):
+    assert client.get(f'/processed/{name}').status_code == 404
@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+import storage
+from fake_s3 import FakeS3Client
+
+
+@pytest.fixture
+def folders(tmp_path):
+    folders = {'uploads': str(tmp_path / 'uploads'), 'processed': str(tmp_path / 'processed')}
+    for folder in folders.values():
+        os.makedirs(folder)
+    return folders
+
+
+@pytest.fixture
+def s3(folders, tmp_path):
+    return storage.S3Storage(folders, 'bucket', FakeS3Client(str(tmp_path / 's3')), prefix='app/')
+
+
+def write(store, area, name, data=b'data', age=0):
+    path = store.path(area, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+
+def test_local_storage(folders):
+    store = storage.LocalStorage(folders)
+    assert store.fetch('processed', 'missing.png') is None
+    path = write(store, 'processed', 'a.png')
+    assert store.fetch('processed', 'a.png') == path
+    assert store.stored('processed', 'a.png')
+    assert [name for name, _, _ in store.list('processed')] == ['a.png']
+    assert store.download_url('processed', 'a.png') is None
+    assert store.trim_cache(0) == 0
+    store.delete('processed', 'a.png')
+    assert not store.exists('processed', 'a.png')
+
+
+def test_s3_fetch_restores_evicted_copy(s3):
+    write(s3, 'processed', 'a.png', b'payload')
+    s3.save('processed', 'a.png').result(10)
+    s3.evict('processed', 'a.png')
+    assert not os.path.exists(s3.path('processed', 'a.png'))
+    assert s3.stored('processed', 'a.png')
+
+    path = s3.fetch('processed', 'a.png')
+    with open(path, 'rb') as f:
+        assert f.read() == b'payload'
+    assert [name for name, _, _ in s3.list('processed')] == ['a.png']
+
+
+def test_s3_fetch_miss_returns_none(s3):
+    assert s3.fetch('processed', 'missing.png') is None
+    assert not s3.exists('processed', 'missing.png')
+    assert os.listdir(s3.folders['processed']) == []
+
+
+def test_s3_fetch_unreachable_endpoint_returns_none(s3, monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise EndpointConnectionError(endpoint_url='http://s3.invalid')
+    monkeypatch.setattr(s3.client, 'download_file', unreachable)
+    assert s3.fetch('processed', 'a.png') is None
+
+
+def test_s3_trim_cache_evicts_least_recently_used(s3):
+    write(s3, 'processed', 'old.png', b'x' * 100, age=3 * storage.CACHE_GRACE)
+    write(s3, 'uploads', 'older.jpg', b'x' * 100, age=4 * storage.CACHE_GRACE)
+    write(s3, 'processed', 'uploading.png', b'x' * 100, age=5 * storage.CACHE_GRACE)
+    write(s3, 'processed', 'new.png', b'x' * 100)
+    s3._uploading.add(s3.path('processed', 'uploading.png'))
+
+    # Recent copies and ones still being uploaded are kept even over the limit
+    assert s3.trim_cache(100) == 200
+    assert sorted(os.listdir(s3.folders['processed'])) == ['new.png', 'uploading.png']
+    assert os.listdir(s3.folders['uploads']) == []
+
+
+def test_s3_presigned_urls(s3):
+    url = s3.download_url('processed', 'a.png', as_attachment=True)
+    assert url.endswith(os.path.join('bucket', 'app', 'processed', 'a.png'))
+
+    form = s3.upload_form('photo.jpg', 1024)
+    assert form['filename'].endswith('_photo.jpg')
+    assert form['fields']['key'] == f"app/uploads/{form['filename']}"
+
+
+def test_from_config_uses_fake_s3_for_file_endpoints(folders, tmp_path):
+    store = storage.from_config({
+        'UPLOAD_FOLDER': folders['uploads'], 'PROCESSED_FOLDER': folders['processed'],
+        'STORAGE_BACKEND': 's3', 'S3_BUCKET': 'bucket', 'S3_ENDPOINT_URL': f'file://{tmp_path}/s3'})
+    assert isinstance(store, storage.S3Storage) and isinstance(store.client, FakeS3Client)
@@ -0,0 +1,69 @@
+import io
+
+import cv2
+import pytest
+
+from benchmark import synthetic_image
+
+BAD_REQUESTS = [
+    ('/process_artisan', {'filename': 1, 'operation': 'edges'}),
+    ('/process_artisan', {'filename': '../app.py', 'operation': 'edges'}),
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': ['x']}),
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': 'bogus'}),
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': 'bw'}),
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': 'bw', 'preview': 512}),
+    ('/process_artisan', {'filename': 1, 'operation': 'edges', 'preview': 512}),
+    ('/process_artisan', ['valid.jpg', 'edges']),
+    ('/process_advanced', {'filename': 1, 'operation': 'bw'}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': ['x']}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'bogus'}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'edges'}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'bw', 'mode': 'analysis'}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'bogus', 'preview': 512}),
+    ('/process_pipeline', {'filename': 1, 'operations': ['bw']}),
+    ('/process_pipeline', {'filename': 'valid.jpg', 'operations': 'bw'}),
+    ('/process_pipeline', {'filename': 'valid.jpg', 'operations': []}),
+    ('/process_pipeline', {'filename': 'valid.jpg', 'operations': [1]}),
+    ('/process_pipeline', {'filename': 'valid.jpg', 'operations': ['bw', 'bogus']}),
+]
+
+
+@pytest.fixture(scope='module')
+def valid(app_module):
+    cv2.imwrite(app_module.store.path('uploads', 'valid.jpg'), synthetic_image(320, 240))
+
+
+@pytest.mark.parametrize('route, body', BAD_REQUESTS)
+def test_bad_input_is_a_400(client, valid, route, body):
+    response = client.post(route, json=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('route, body', [
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': 'edges'}),
+    ('/process_artisan', {'filename': 'valid.jpg', 'operation': 'edges', 'preview': 256}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'bw'}),
+    ('/process_advanced', {'filename': 'valid.jpg', 'operation': 'detect_objects', 'mode': 'analysis'}),
+    ('/process_pipeline', {'filename': 'valid.jpg', 'operations': ['bw', 'edges']}),
+])
+def test_valid_input_is_processed(client, valid, route, body):
+    assert client.post(route, json=body).status_code == 200
+
+
+def test_missing_artifact_is_a_404(client):
+    response = client.post('/process_artisan', json={'filename': 'missing.jpg', 'operation': 'edges'})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('operations', ['["bogus"]', '[1]', '[]'])
+def test_batch_rejects_bad_operations(client, operations):
+    response = client.post('/process_batch', data={'operations': operations, 'files': (io.BytesIO(b'x'), 'a.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_advanced_canvas_upload_checks_operation(client):
+    response = client.post('/process_advanced', data={'operation': 'bogus', 'file': (io.BytesIO(b'x'), 'c.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400